@@ -1,18 +1,257 @@
 import abc
+import asyncio
+import inspect
+import logging
+import random
+import time
+from datetime import datetime
+from enum import Enum
+from http import HTTPStatus
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+import httpx
 
 from api.config import Settings, get_settings
+from api.exceptions import RepositoryException
 from api.models.catalog import DatasetMetadataDOC
+from api.models.http_cache import HttpCacheEntry
 from api.models.user import Submission
 
+logger = logging.getLogger()
+
+
+class _HttpClientPool:
+    """A keep-alive HTTP client shared by all repository request handlers, with a connection limit per host.
+
+    The client and the host semaphores belong to the event loop they are created in, a new event loop (e.g. a test)
+    gets its own.
+    """
+
+    def __init__(self):
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._client: Optional[httpx.AsyncClient] = None
+        self._host_limits: Dict[str, asyncio.Semaphore] = {}
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._loop is not loop or self._client.is_closed:
+            settings = get_settings()
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(settings.repository_http_timeout,
+                                      connect=settings.repository_http_connect_timeout),
+                limits=httpx.Limits(max_connections=settings.repository_max_connections,
+                                    max_keepalive_connections=settings.repository_max_connections),
+            )
+            self._loop = loop
+            self._host_limits = {}
+        return self._client
+
+    def host_limit(self, url: str) -> asyncio.Semaphore:
+        host = urlsplit(url).netloc
+        if host not in self._host_limits:
+            self._host_limits[host] = asyncio.Semaphore(get_settings().repository_max_connections_per_host)
+        return self._host_limits[host]
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+http_client_pool = _HttpClientPool()
+
+
+class CircuitState(str, Enum):
+    CLOSED = 'CLOSED'
+    OPEN = 'OPEN'
+    HALF_OPEN = 'HALF_OPEN'
+
+
+class CircuitBreaker:
+    """Fails the requests to a repository fast while it is down.
+
+    The breaker opens after `failure_threshold` consecutive failed requests, a 5xx response, a timeout or a connection
+    failure. While open every request is rejected, after `reset_timeout` seconds a single trial request is let through
+    (half open), which closes the breaker when it succeeds and opens it again when it fails.
+    """
+
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CircuitState.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None
+        self.counters = {"requests": 0, "successes": 0, "failures": 0, "retries": 0, "rejected": 0, "opened": 0}
+        self._trial_in_flight = False
+
+    def allow(self) -> bool:
+        """Returns whether a request can be sent, a request that is allowed must be followed by a call to
+        `record_success` or `record_failure`"""
+        if self.state == CircuitState.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.state = CircuitState.HALF_OPEN
+            self._trial_in_flight = False
+        if self.state == CircuitState.OPEN or (self.state == CircuitState.HALF_OPEN and self._trial_in_flight):
+            self.counters["rejected"] += 1
+            return False
+        if self.state == CircuitState.HALF_OPEN:
+            self._trial_in_flight = True
+        self.counters["requests"] += 1
+        return True
+
+    def release(self) -> None:
+        """Ends an allowed request that has no result, e.g. a cancelled one, so that a half open breaker lets the
+        next request through as its trial"""
+        self._trial_in_flight = False
+
+    def record_success(self) -> None:
+        self.counters["successes"] += 1
+        self.consecutive_failures = 0
+        if self.state != CircuitState.CLOSED:
+            logger.info(f"Repository {self.name} has recovered, closing its circuit breaker")
+        self.state = CircuitState.CLOSED
+        self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        self.counters["failures"] += 1
+        self.consecutive_failures += 1
+        if self.state == CircuitState.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            if self.state != CircuitState.OPEN:
+                self.counters["opened"] += 1
+                logger.warning(f"Repository {self.name} is failing, opening its circuit breaker for "
+                               f"{self.reset_timeout} seconds")
+            self.state = CircuitState.OPEN
+            self.opened_at = time.monotonic()
+            self._trial_in_flight = False
+
+    def stats(self) -> dict:
+        return {"state": self.state, "consecutive_failures": self.consecutive_failures, **self.counters}
+
+
+class _CircuitBreakers:
+    """The circuit breakers of the repositories, one per repository host"""
+
+    def __init__(self):
+        self._breakers: Dict[str, CircuitBreaker] = {}
+
+    def get(self, url: str) -> CircuitBreaker:
+        host = urlsplit(url).netloc
+        if host not in self._breakers:
+            settings = get_settings()
+            self._breakers[host] = CircuitBreaker(host, settings.repository_breaker_failure_threshold,
+                                                  settings.repository_breaker_reset_timeout)
+        return self._breakers[host]
+
+    def stats(self) -> Dict[str, dict]:
+        return {host: breaker.stats() for host, breaker in self._breakers.items()}
+
+
+circuit_breakers = _CircuitBreakers()
+
+
+def backoff_delay(retry: int, base_delay: float, max_delay: float) -> float:
+    """Returns a random delay of up to `base_delay` * 2^(`retry` - 1) seconds, capped at `max_delay` (full jitter)"""
+    return random.uniform(0, min(max_delay, base_delay * 2 ** (retry - 1)))
+
+
+# returned by get_metadata in place of the metadata when the record has not changed since it was last fetched
+NOT_MODIFIED = object()
+
+
+class HttpCache:
+    """Conditional requests for repository urls using the ETag/Last-Modified validators of their last response,
+    persisted in the http_cache collection.
+
+    Validators are kept per `scope`, the record they were stored for, as one repository url can back several
+    records. The validators of new responses are kept pending until `save` is called, which is done once the record
+    fetched with them has been stored, so that a record whose write failed is fetched in full again the next time.
+    """
+
+    def __init__(self, scope: str):
+        self.scope = scope
+        self._pending: Dict[str, HttpCacheEntry] = {}
+
+    async def request_headers(self, url: str) -> dict:
+        entry = await HttpCacheEntry.find_one(HttpCacheEntry.scope == self.scope, HttpCacheEntry.url == url)
+        headers = {}
+        if entry is not None:
+            if entry.etag:
+                headers["If-None-Match"] = entry.etag
+            if entry.last_modified:
+                headers["If-Modified-Since"] = entry.last_modified
+        return headers
+
+    def record(self, url: str, response: httpx.Response) -> None:
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        if etag or last_modified:
+            self._pending[url] = HttpCacheEntry(scope=self.scope, url=url, etag=etag, last_modified=last_modified,
+                                                fetched=datetime.utcnow())
+
+    async def save(self) -> None:
+        for entry in self._pending.values():
+            await HttpCacheEntry.find_one(HttpCacheEntry.scope == self.scope, HttpCacheEntry.url == entry.url).upsert(
+                {"$set": entry.dict(exclude={"id", "revision_id"})}, on_insert=entry
+            )
+        self._pending.clear()
+
 
 class AbstractRepositoryRequestHandler(abc.ABC):
     settings: Settings = get_settings()
 
     @abc.abstractmethod
-    def get_metadata(self, record_id: str):
-        """Returns the metadata for the specified record from a repository"""
+    def get_metadata(self, record_id: str, http_cache: Optional[HttpCache] = None):
+        """Returns the metadata for the specified record from a repository, handlers may implement this as a
+        coroutine. Handlers supporting conditional requests return NOT_MODIFIED when given an `http_cache` and the
+        record has not changed."""
         ...
 
+    async def http_get(self, url: str, http_cache: Optional[HttpCache] = None) -> httpx.Response:
+        """Sends a GET request with the shared client. 5xx responses, timeouts and other request failures are retried
+        with a jittered exponential backoff, a failure of the last attempt is raised as a RepositoryException. While
+        the circuit breaker of the repository is open the request fails fast with a 503. With an `http_cache` the
+        request is conditional and may be answered with a 304."""
+        client = http_client_pool.client
+        breaker = circuit_breakers.get(url)
+        headers = await http_cache.request_headers(url) if http_cache is not None else None
+        for attempt in range(self.settings.repository_retry_attempts):
+            if attempt:
+                breaker.counters["retries"] += 1
+                await asyncio.sleep(backoff_delay(attempt, self.settings.repository_retry_base_delay,
+                                                  self.settings.repository_retry_max_delay))
+            if not breaker.allow():
+                raise RepositoryException(status_code=HTTPStatus.SERVICE_UNAVAILABLE,
+                                          detail=f"Repository is unavailable, try again later: {url}")
+            error = None
+            try:
+                async with http_client_pool.host_limit(url):
+                    response = await client.get(url, headers=headers)
+            except httpx.TimeoutException:
+                error = RepositoryException(status_code=HTTPStatus.GATEWAY_TIMEOUT,
+                                            detail=f"Repository request timed out: {url}")
+            except httpx.HTTPError as ex:
+                error = RepositoryException(status_code=HTTPStatus.BAD_GATEWAY,
+                                            detail=f"Repository request failed: {url} ({str(ex)})")
+            except asyncio.CancelledError:
+                breaker.release()
+                raise
+            except BaseException:
+                # every allowed request is recorded, a half open breaker waits for the result of its trial
+                breaker.record_failure()
+                raise
+            if error is not None or response.status_code >= HTTPStatus.INTERNAL_SERVER_ERROR:
+                breaker.record_failure()
+                continue
+            breaker.record_success()
+            if http_cache is not None and response.status_code == HTTPStatus.OK:
+                http_cache.record(url, response)
+            return response
+        if error is not None:
+            raise error
+        return response
+
 
 class AbstractRepositoryMetadataAdapter(abc.ABC):
     repo_api_handler: AbstractRepositoryRequestHandler
@@ -35,7 +274,11 @@ class AbstractRepositoryMetadataAdapter(abc.ABC):
         """Sets additional repository specific metadata to submission record"""
         ...
 
-    async def get_metadata(self, record_id: str):
-        """Returns the metadata for the specified record from a repository"""
+    async def get_metadata(self, record_id: str, http_cache: Optional[HttpCache] = None):
+        """Returns the metadata for the specified record from a repository, or NOT_MODIFIED when an `http_cache`
+        is given and the record has not changed since it was last fetched"""
 
-        return self.repo_api_handler.get_metadata(record_id)
+        metadata = self.repo_api_handler.get_metadata(record_id, http_cache=http_cache)
+        if inspect.isawaitable(metadata):
+            metadata = await metadata
+        return metadata
@@ -1,9 +1,17 @@
-import requests
+import asyncio
+import math
 from datetime import datetime
 from typing import List, Optional, Union
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
 from pydantic import BaseModel, EmailStr, HttpUrl
 
-from api.adapters.base import AbstractRepositoryMetadataAdapter, AbstractRepositoryRequestHandler
+from api.adapters.base import (
+    NOT_MODIFIED,
+    AbstractRepositoryMetadataAdapter,
+    AbstractRepositoryRequestHandler,
+    HttpCache,
+)
 from api.adapters.utils import RepositoryType, register_adapter
 from api.exceptions import RepositoryException
 from api.models import schema
@@ -163,31 +171,64 @@ class Rights(BaseModel):
 
 
 class _HydroshareRequestHandler(AbstractRepositoryRequestHandler):
-    def get_metadata(self, record_id: str):
+    async def get_metadata(self, record_id: str, http_cache: Optional[HttpCache] = None):
         hs_meta_url = self.settings.hydroshare_meta_read_url % record_id
         hs_file_url = self.settings.hydroshare_file_read_url % record_id
 
-        def make_request(url, file_list=False) -> Union[dict, List[dict]]:
-            response = requests.get(url)
-            if response.status_code != 200:
-                raise RepositoryException(status_code=response.status_code, detail=response.text)
-            if not file_list:
-                return response.json()
-
-            content_files = []
-            content_files.extend(response.json()["results"])
-            # check if there are more results to fetch - by default, 100 files are returned from HydroShare
-            while response.json()["next"]:
-                response = requests.get(response.json()["next"])
-                if response.status_code != 200:
-                    raise RepositoryException(status_code=response.status_code, detail=response.text)
-                content_files.extend(response.json()["results"])
+        metadata, files_page = await asyncio.gather(self._get_json(hs_meta_url, http_cache),
+                                                    self._get_json(hs_file_url, http_cache))
+        # a change to any file changes the resource metadata (modified date) or the first page (count)
+        if metadata is NOT_MODIFIED and files_page is NOT_MODIFIED:
+            return NOT_MODIFIED
+        if metadata is NOT_MODIFIED:
+            metadata = await self._get_json(hs_meta_url)
+        if files_page is NOT_MODIFIED:
+            files_page = await self._get_json(hs_file_url)
+        metadata["content_files"] = await self._get_content_files(files_page)
+        return metadata
+
+    async def _get_json(self, url: str, http_cache: Optional[HttpCache] = None) -> dict:
+        response = await self.http_get(url, http_cache)
+        if response.status_code == 304:
+            return NOT_MODIFIED
+        if response.status_code != 200:
+            raise RepositoryException(status_code=response.status_code, detail=response.text)
+        return response.json()
+
+    async def _get_content_files(self, first_page: dict) -> List[dict]:
+        """Returns the files of all pages of the file list given its first page"""
+        content_files = list(first_page["results"])
+        # by default, 100 files are returned from HydroShare per page
+        if not first_page["next"]:
+            return content_files
+        if not first_page.get("count") or not first_page["results"]:
+            # the number of pages is not known, follow the pages one by one
+            page = first_page
+            while page["next"]:
+                page = await self._get_json(page["next"])
+                content_files.extend(page["results"])
             return content_files
 
-        metadata = make_request(hs_meta_url)
-        files_metadata = make_request(hs_file_url, file_list=True)
-        metadata["content_files"] = files_metadata
-        return metadata
+        page_count = math.ceil(first_page["count"] / len(first_page["results"]))
+        page_limit = asyncio.Semaphore(self.settings.hydroshare_file_page_concurrency)
+
+        async def get_page(page_number: int) -> List[dict]:
+            async with page_limit:
+                page = await self._get_json(_page_url(first_page["next"], page_number))
+            return page["results"]
+
+        pages = await asyncio.gather(*[get_page(page_number) for page_number in range(2, page_count + 1)])
+        for results in pages:
+            content_files.extend(results)
+        return content_files
+
+
+def _page_url(url: str, page_number: int) -> str:
+    """Sets the page number of a file list page url"""
+    parts = urlsplit(url)
+    query = dict(parse_qsl(parts.query))
+    query["page"] = str(page_number)
+    return urlunsplit(parts._replace(query=urlencode(query)))
 
 
 class HydroshareMetadataAdapter(AbstractRepositoryMetadataAdapter):
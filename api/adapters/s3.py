@@ -1,25 +1,81 @@
+import asyncio
 import json
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from http import HTTPStatus
+from typing import List, Optional
 
 import boto3
 from botocore import UNSIGNED
-from botocore.client import Config
+from botocore.client import BaseClient, Config
 from botocore.exceptions import ClientError as S3ClientError
 
-from api.adapters.base import AbstractRepositoryMetadataAdapter, AbstractRepositoryRequestHandler
+from api.adapters.base import AbstractRepositoryMetadataAdapter, AbstractRepositoryRequestHandler, HttpCache
 from api.adapters.utils import RepositoryType, register_adapter
+from api.config import get_settings
 from api.exceptions import RepositoryException
 from api.models.catalog import DatasetMetadataDOC
 from api.models.user import Submission
 
+# number of bytes of an S3 metadata file read at a time
+S3_READ_CHUNK_SIZE = 64 * 1024
+
+
+class _S3ClientPool:
+    """One S3 client per endpoint url, created on first use and shared by all threads, and the bounded thread pool
+    the blocking S3 calls are run in. The endpoint urls come from requests, at most `s3_max_clients` clients are
+    kept and the least recently used one is closed to make room for a new one."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._clients: OrderedDict[str, BaseClient] = OrderedDict()
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def client(self, endpoint_url: str) -> BaseClient:
+        with self._lock:
+            client = self._clients.get(endpoint_url)
+            if client is None:
+                # sessions are not thread safe, clients are
+                config = Config(signature_version=UNSIGNED,
+                                max_pool_connections=get_settings().s3_max_pool_connections)
+                client = boto3.session.Session().client('s3', config=config, endpoint_url=endpoint_url)
+                self._clients[endpoint_url] = client
+                while len(self._clients) > get_settings().s3_max_clients:
+                    _, evicted = self._clients.popitem(last=False)
+                    evicted.close()
+            else:
+                self._clients.move_to_end(endpoint_url)
+        return client
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=get_settings().s3_max_workers,
+                                                        thread_name_prefix="s3")
+        return self._executor
+
+    async def run(self, func, *args):
+        """Runs a blocking S3 call in the thread pool"""
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+
+s3_client_pool = _S3ClientPool()
+
 
 class _S3RequestHandler(AbstractRepositoryRequestHandler):
-    def get_metadata(self, record_id: str):
+    async def get_metadata(self, record_id: str, http_cache: Optional[HttpCache] = None):
         endpoint_url = record_id.split("+")[0]
         bucket_name = record_id.split("+")[1]
         file_key = record_id.split("+")[2]
 
-        s3 = boto3.client('s3', config=Config(signature_version=UNSIGNED), endpoint_url=endpoint_url)
+        return await s3_client_pool.run(self._get_metadata, endpoint_url, bucket_name, file_key)
+
+    @staticmethod
+    def _get_metadata(endpoint_url: str, bucket_name: str, file_key: str):
+        s3 = s3_client_pool.client(endpoint_url)
         try:
             response = s3.get_object(Bucket=bucket_name, Key=file_key)
         except S3ClientError as ex:
@@ -32,16 +88,67 @@ class _S3RequestHandler(AbstractRepositoryRequestHandler):
                 err_msg = f"Error accessing S3 file({bucket_name}/{file_key}): {str(ex)}"
                 raise RepositoryException(detail=err_msg, status_code=HTTPStatus.BAD_REQUEST)
 
-        json_content = response['Body'].read().decode('utf-8')
+        json_content = _S3RequestHandler._read_body(response, bucket_name, file_key)
         # Parse the JSON content
         try:
             data = json.loads(json_content)
-        except json.JSONDecodeError as ex:
+        except ValueError as ex:
+            # a JSONDecodeError or a UnicodeDecodeError of content that is not UTF-8
             err_msg = f"Invalid JSON content in S3 file ({file_key}). Error: {str(ex)}"
             raise RepositoryException(detail=err_msg, status_code=HTTPStatus.BAD_REQUEST)
 
         return data
 
+    @staticmethod
+    def _read_body(response: dict, bucket_name: str, file_key: str) -> bytes:
+        """Reads the body of a get_object response a chunk at a time, failing as soon as it is larger than the
+        configured maximum metadata file size"""
+        max_size = get_settings().s3_metadata_max_size
+        body = response['Body']
+        too_large = RepositoryException(
+            detail=f"S3 file ({bucket_name}/{file_key}) is larger than the maximum metadata file size of "
+                   f"{max_size} bytes",
+            status_code=HTTPStatus.REQUEST_ENTITY_TOO_LARGE
+        )
+        if response.get('ContentLength', 0) > max_size:
+            body.close()
+            raise too_large
+        content = bytearray()
+        # the content length is checked above, this also bounds the read when the length is missing or wrong
+        for chunk in body.iter_chunks(chunk_size=S3_READ_CHUNK_SIZE):
+            content.extend(chunk)
+            if len(content) > max_size:
+                body.close()
+                raise too_large
+        return bytes(content)
+
+    async def list_metadata_files(self, endpoint_url: str, bucket_name: str, prefix: str, max_keys: int) -> List[str]:
+        return await s3_client_pool.run(self._list_metadata_files, endpoint_url, bucket_name, prefix, max_keys)
+
+    @staticmethod
+    def _list_metadata_files(endpoint_url: str, bucket_name: str, prefix: str, max_keys: int) -> List[str]:
+        """Returns the keys of the JSON files under the prefix, listed a page of 1000 keys at a time"""
+        s3 = s3_client_pool.client(endpoint_url)
+        keys = []
+        try:
+            for page in s3.get_paginator('list_objects_v2').paginate(Bucket=bucket_name, Prefix=prefix):
+                keys.extend(item['Key'] for item in page.get('Contents', []) if item['Key'].endswith('.json'))
+                if len(keys) > max_keys:
+                    raise RepositoryException(
+                        detail=f"At most {max_keys} metadata files can be registered from a prefix",
+                        status_code=HTTPStatus.REQUEST_ENTITY_TOO_LARGE
+                    )
+        except S3ClientError as ex:
+            if ex.response["Error"]["Code"] == "NoSuchBucket":
+                raise RepositoryException(
+                    detail=f"Specified bucket was not found in S3: {bucket_name}",
+                    status_code=HTTPStatus.NOT_FOUND
+                )
+            else:
+                err_msg = f"Error listing S3 files({bucket_name}/{prefix}): {str(ex)}"
+                raise RepositoryException(detail=err_msg, status_code=HTTPStatus.BAD_REQUEST)
+        return keys
+
 
 class S3MetadataAdapter(AbstractRepositoryMetadataAdapter):
     repo_api_handler = _S3RequestHandler()
@@ -50,6 +157,10 @@ class S3MetadataAdapter(AbstractRepositoryMetadataAdapter):
     def to_catalog_record(metadata: dict) -> DatasetMetadataDOC:
         return DatasetMetadataDOC(**metadata)
 
+    async def list_metadata_files(self, endpoint_url: str, bucket_name: str, prefix: str, max_keys: int) -> List[str]:
+        """Returns the keys of the metadata files under the prefix of the bucket"""
+        return await self.repo_api_handler.list_metadata_files(endpoint_url, bucket_name, prefix, max_keys)
+
     @staticmethod
     def to_repository_record(catalog_record: DatasetMetadataDOC):
         """Converts dataset catalog record to hydroshare resource metadata"""
@@ -1,8 +1,15 @@
+import asyncio
 import json
-import requests
+import logging
+import os
+import time
 from enum import Enum
-from typing import List, Optional
-from urllib.request import urlopen
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+
+from api.adapters.base import http_client_pool
+from api.cache import TTLCache
 from api.procedures.user import get_user
 
 from fastapi import Request
@@ -17,10 +24,15 @@ from fastapi.openapi.models import (
 from fastapi.openapi.models import OAuthFlows as OAuthFlowsModel
 from fastapi.security.base import SecurityBase
 from fastapi.security.utils import get_authorization_scheme_param
-from jose import jwt
-from jose.exceptions import JWTError
+from jose import jwk, jwt
+from jose.backends.base import Key
+from jose.exceptions import JOSEError, JWTError
 from pydantic import BaseModel
-from starlette.status import HTTP_401_UNAUTHORIZED
+from starlette.status import HTTP_401_UNAUTHORIZED, HTTP_503_SERVICE_UNAVAILABLE
+
+logger = logging.getLogger()
+
+ORCID_USERINFO_URL = "https://orcid.org/oauth/userinfo"
 
 
 class GrantType(str, Enum):
@@ -30,20 +42,87 @@ class GrantType(str, Enum):
     PASSWORD = "password"
 
 
-def fetch_well_known(issuer: str) -> dict:
+async def fetch_well_known(client: httpx.AsyncClient, issuer: str) -> dict:
     url = f"{issuer}/.well-known/openid-configuration"
-    with urlopen(url) as response:
-        if response.status != 200:
-            raise RuntimeError("fail to fetch well-known")
-        return json.load(response)
+    response = await client.get(url)
+    if response.status_code != 200:
+        raise RuntimeError("fail to fetch well-known")
+    return response.json()
 
 
-def fetch_jwks(well_known: dict) -> dict:
+async def fetch_jwks(client: httpx.AsyncClient, well_known: dict) -> dict:
     url = well_known["jwks_uri"]
-    with urlopen(url) as response:
-        if response.status != 200:
-            raise RuntimeError("fail to fetch jwks")
-        return json.load(response)
+    response = await client.get(url)
+    if response.status_code != 200:
+        raise RuntimeError("fail to fetch jwks")
+    return response.json()
+
+
+class JwksCache:
+    """The signing keys of the issuer by key id.
+
+    Keys are constructed once when the JWKS is loaded so that verifying a token is CPU only. The JWKS is fetched
+    again in the background once it is older than `refresh_interval`, and right away when a token is signed with an
+    unknown key id, at most once every `min_refresh_interval` seconds so that made up key ids can not flood the issuer.
+    """
+
+    def __init__(self, jwks_uri: str, refresh_interval: float = 3600, min_refresh_interval: float = 30):
+        self.jwks_uri = jwks_uri
+        self.refresh_interval = refresh_interval
+        self.min_refresh_interval = min_refresh_interval
+        # key id -> (key, signing algorithm)
+        self._keys: Dict[str, Tuple[Key, str]] = {}
+        self._fetched_at = float("-inf")
+        self._refresh: Optional[asyncio.Task] = None
+
+    def load(self, jwks: dict) -> None:
+        keys = {}
+        for key_data in jwks.get("keys", []):
+            if key_data.get("use", "sig") != "sig" or "kid" not in key_data:
+                continue
+            algorithm = key_data.get("alg", "RS256")
+            try:
+                keys[key_data["kid"]] = (jwk.construct(key_data, algorithm), algorithm)
+            except JOSEError:
+                logger.warning(f"Skipping unsupported JWKS key {key_data['kid']}")
+        self._keys = keys
+        self._fetched_at = time.monotonic()
+
+    async def get_key(self, kid: str) -> Optional[Tuple[Key, str]]:
+        age = time.monotonic() - self._fetched_at
+        key = self._keys.get(kid)
+        if key is not None:
+            if age > self.refresh_interval:
+                self.refresh()
+            return key
+        if age > self.min_refresh_interval:
+            # the issuer may have rotated its keys
+            try:
+                await asyncio.shield(self.refresh())
+            except Exception:
+                return None
+            return self._keys.get(kid)
+        return None
+
+    def refresh(self) -> asyncio.Task:
+        """Starts fetching the JWKS unless a fetch is already in flight and returns the fetch task"""
+        if self._refresh is None or self._refresh.done():
+            self._refresh = asyncio.ensure_future(self._fetch())
+            # failures are logged by the fetch, the callers refreshing in the background do not wait for the result
+            self._refresh.add_done_callback(lambda task: task.cancelled() or task.exception())
+        return self._refresh
+
+    async def _fetch(self) -> None:
+        try:
+            async with httpx.AsyncClient(timeout=10) as client:
+                response = await client.get(self.jwks_uri)
+                response.raise_for_status()
+            self.load(response.json())
+        except Exception as exp:
+            # keep verifying with the current keys, the next refresh is tried after min_refresh_interval
+            self._fetched_at = time.monotonic() - self.refresh_interval + self.min_refresh_interval
+            logger.exception(f"JWKS refresh failed.\n Error:{str(exp)}")
+            raise
 
 
 class JwtDecodeOptions(BaseModel):
@@ -76,21 +155,108 @@ class OidcResourceServer(SecurityBase):
         allowed_grant_types: List[GrantType] = [GrantType.AUTHORIZATION_CODE],
         auto_error: Optional[bool] = True,
         jwt_decode_options: Optional[JwtDecodeOptions] = None,
+        claims_cache_size: int = 10000,
+        claims_cache_ttl: float = 60,
+        verify_tokens: bool = False,
+        orcid_claim: str = "preferred_username",
+        jwks_refresh_interval: float = 3600,
+        jwks_min_refresh_interval: float = 30,
+        snapshot_path: Optional[str] = None,
     ) -> None:
         self.scheme_name = scheme_name
         self.auto_error = auto_error
         self.jwt_decode_options = jwt_decode_options
+        # access token -> claims, so that a known token is not looked up again on every request
+        self.claims_cache = TTLCache(maxsize=claims_cache_size, ttl=claims_cache_ttl)
+        # access token -> in flight ORCID lookup, concurrent requests with a new token share a single lookup
+        self._orcid_lookups: Dict[str, asyncio.Task] = {}
+        # with verify_tokens the access tokens are JWTs issued by the issuer and are verified locally
+        self.verify_tokens = verify_tokens
+        self.orcid_claim = orcid_claim
+
+        # the discovery documents are loaded on first use, so that constructing the server needs no network I/O
+        self.issuer = issuer
+        self.allowed_grant_types = allowed_grant_types
+        self.jwks_refresh_interval = jwks_refresh_interval
+        self.jwks_min_refresh_interval = jwks_min_refresh_interval
+        # the last discovery documents fetched are saved to this file and are used when the issuer is not reachable
+        self.snapshot_path = snapshot_path
+        self.well_known: Optional[dict] = None
+        self.jwks: Optional[dict] = None
+        self.jwks_cache: Optional[JwksCache] = None
+        self._model: Optional[OAuth2Model] = None
+        self._discovery: Optional[asyncio.Task] = None
+
+    @property
+    def ready(self) -> bool:
+        """Whether the discovery documents are loaded"""
+        return self.well_known is not None
 
-        self.well_known = fetch_well_known(issuer)
-        self.jwks = fetch_jwks(self.well_known)
+    @property
+    def model(self) -> OAuth2Model:
+        if self._model is None:
+            # the flows are not known until the discovery documents are loaded
+            return OAuth2Model(flows=OAuthFlowsModel())
+        return self._model
 
-        grant_types = set(self.well_known["grant_types_supported"])
-        grant_types = grant_types.intersection(allowed_grant_types)
+    async def discover(self) -> None:
+        """Loads the discovery documents unless they are loaded, concurrent callers share a single load"""
+        if self.ready:
+            return
+        await asyncio.shield(self.start_discovery())
+
+    def start_discovery(self) -> asyncio.Task:
+        """Starts loading the discovery documents in the background unless a load is already in flight"""
+        if self._discovery is None or self._discovery.done():
+            self._discovery = asyncio.ensure_future(self._discover())
+            # failures are logged by the load and retried by the next caller
+            self._discovery.add_done_callback(lambda task: task.cancelled() or task.exception())
+        return self._discovery
+
+    async def _discover(self) -> None:
+        try:
+            async with httpx.AsyncClient(timeout=10) as client:
+                well_known = await fetch_well_known(client, self.issuer)
+                jwks = await fetch_jwks(client, well_known)
+            self._save_snapshot(well_known, jwks)
+        except Exception as exp:
+            snapshot = self._load_snapshot()
+            if snapshot is None:
+                logger.exception(f"OIDC discovery failed.\n Error:{str(exp)}")
+                raise
+            logger.warning(f"OIDC discovery failed, using the snapshot {self.snapshot_path}.\n Error:{str(exp)}")
+            well_known, jwks = snapshot["well_known"], snapshot["jwks"]
+        self.jwks_cache = JwksCache(well_known["jwks_uri"], self.jwks_refresh_interval, self.jwks_min_refresh_interval)
+        self.jwks_cache.load(jwks)
+        self.jwks = jwks
+        self._model = self._build_model(well_known)
+        self.well_known = well_known
+
+    def _save_snapshot(self, well_known: dict, jwks: dict) -> None:
+        if not self.snapshot_path:
+            return
+        try:
+            # written to a temporary file first so that a concurrent reader never sees a partial snapshot
+            with open(f"{self.snapshot_path}.tmp", "w") as f:
+                json.dump({"well_known": well_known, "jwks": jwks}, f)
+            os.replace(f"{self.snapshot_path}.tmp", self.snapshot_path)
+        except OSError as exp:
+            logger.warning(f"Could not save the OIDC discovery snapshot {self.snapshot_path}.\n Error:{str(exp)}")
+
+    def _load_snapshot(self) -> Optional[dict]:
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return None
+        with open(self.snapshot_path) as f:
+            return json.load(f)
+
+    def _build_model(self, well_known: dict) -> OAuth2Model:
+        grant_types = set(well_known["grant_types_supported"])
+        grant_types = grant_types.intersection(self.allowed_grant_types)
 
         flows = OAuthFlowsModel()
 
-        authz_url = self.well_known["authorization_endpoint"]
-        token_url = self.well_known["token_endpoint"]
+        authz_url = well_known["authorization_endpoint"]
+        token_url = well_known["token_endpoint"]
 
         if GrantType.AUTHORIZATION_CODE in grant_types:
             flows.authorizationCode = OAuthFlowAuthorizationCode(
@@ -108,7 +274,7 @@ class OidcResourceServer(SecurityBase):
         if GrantType.IMPLICIT in grant_types:
             flows.implicit = OAuthFlowImplicit(authorizationUrl=authz_url, scopes={"openid": "Read ORCID for the current user"})
 
-        self.model = OAuth2Model(flows=flows)
+        return OAuth2Model(flows=flows)
 
     async def __call__(self, request: Request) -> Optional[str]:
         authorization: str = request.headers.get("Authorization")
@@ -124,20 +290,20 @@ class OidcResourceServer(SecurityBase):
 
             return None
 
+        if self.verify_tokens:
+            return await self.verify(param)
+
+        claims = self.claims_cache.get(param)
+        if claims is not None:
+            return claims
         try:
             #return jwt.decode(param, self.jwks, options=self.jwt_decode_options)
             # this is a temporary hack until cuahsi keycloak is stable
             user = await get_user(access_token=param)
-            orcid = None
             if not user:
-                resp = requests.get("https://orcid.org/oauth/userinfo", headers={"Authorization": f"Bearer {param}"})
-                if resp.status_code == 200:
-                    orcid = resp.json()['sub']
-                else:
-                    raise
+                orcid = await self._lookup_orcid(param)
             else:
                 orcid = user.orcid
-            return {"orcid": orcid, "access_token": param}
         #except JWTError:
         except:
             raise HTTPException(
@@ -145,3 +311,52 @@ class OidcResourceServer(SecurityBase):
                 detail="JWT validation failed",
                 headers={"WWW-Authenticate": "Bearer"},
             )
+        claims = {"orcid": orcid, "access_token": param}
+        self.claims_cache.set(param, claims)
+        return claims
+
+    async def verify(self, token: str) -> dict:
+        """Verifies the signature and the claims of the JWT with the cached signing keys of the issuer"""
+        try:
+            await self.discover()
+        except Exception:
+            raise HTTPException(
+                status_code=HTTP_503_SERVICE_UNAVAILABLE,
+                detail="The OpenID Connect issuer is not available",
+            )
+        try:
+            kid = jwt.get_unverified_header(token).get("kid")
+            signing_key = await self.jwks_cache.get_key(kid)
+            if signing_key is None:
+                raise JWTError(f"Unknown signing key {kid}")
+            key, algorithm = signing_key
+            options = self.jwt_decode_options.dict(exclude_none=True) if self.jwt_decode_options else None
+            claims = jwt.decode(token, key, algorithms=[algorithm], options=options,
+                                issuer=self.well_known["issuer"])
+            claims["orcid"] = claims[self.orcid_claim]
+        except (JWTError, KeyError):
+            raise HTTPException(
+                status_code=HTTP_401_UNAUTHORIZED,
+                detail="JWT validation failed",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+        claims["access_token"] = token
+        return claims
+
+    async def _lookup_orcid(self, access_token: str) -> str:
+        lookup = self._orcid_lookups.get(access_token)
+        if lookup is None:
+            lookup = asyncio.ensure_future(fetch_orcid(access_token))
+            self._orcid_lookups[access_token] = lookup
+            lookup.add_done_callback(lambda _: self._orcid_lookups.pop(access_token, None))
+        # shielded so that a cancelled request does not cancel the lookup shared with the other requests
+        return await asyncio.shield(lookup)
+
+
+async def fetch_orcid(access_token: str) -> str:
+    """Returns the ORCID of the user the access token was issued to"""
+    headers = {"Authorization": f"Bearer {access_token}"}
+    response = await http_client_pool.client.get(ORCID_USERINFO_URL, headers=headers, timeout=10)
+    if response.status_code != 200:
+        raise RuntimeError(f"ORCID userinfo lookup failed with status {response.status_code}")
+    return response.json()['sub']
@@ -1,18 +1,36 @@
 from fastapi import Security
 
 from api.authentication.fastapi_resource_server import GrantType, JwtDecodeOptions, OidcResourceServer
+from api.cache import TTLCache
 from api.config import get_settings
 from api.models.user import User
-from api.procedures.user import create_or_update_user
+from api.procedures.user import create_or_update_user, user_version
 
 decode_options = JwtDecodeOptions(verify_aud=False)
 
 auth_scheme = OidcResourceServer(
-    get_settings().oidc_issuer, jwt_decode_options=decode_options, allowed_grant_types=[GrantType.IMPLICIT]
+    get_settings().oidc_issuer,
+    jwt_decode_options=decode_options,
+    allowed_grant_types=[GrantType.IMPLICIT],
+    claims_cache_size=get_settings().auth_cache_size,
+    claims_cache_ttl=get_settings().auth_cache_ttl,
+    verify_tokens=get_settings().oidc_verify_tokens,
+    orcid_claim=get_settings().oidc_orcid_claim,
+    jwks_refresh_interval=get_settings().oidc_jwks_refresh_interval,
+    jwks_min_refresh_interval=get_settings().oidc_jwks_min_refresh_interval,
+    snapshot_path=get_settings().oidc_snapshot_path,
 )
 
+# access token -> user with the submissions fetched. A cached user is used while its version is the version in the
+# database, the submission writes of other processes and of the background jobs increment the version.
+user_cache = TTLCache(maxsize=get_settings().auth_cache_size, ttl=get_settings().auth_cache_ttl)
+
 
 async def get_current_user(claims: dict = Security(auth_scheme)) -> User:
+    user = user_cache.get(claims['access_token'])
+    if user is not None and await user_version(user.id) == user.version:
+        return user
     #user = await create_or_update_user(claims["preferred_username"])
     user = await create_or_update_user(claims['orcid'], claims['access_token'])
+    user_cache.set(claims['access_token'], user)
     return user
@@ -0,0 +1,59 @@
+import time
+from collections import OrderedDict
+from typing import Any, Hashable
+
+# collection holding one version counter document per cached collection, e.g. {"_id": "discovery", "version": 7}
+CACHE_VERSIONS_COLLECTION = "cache_versions"
+
+
+class TTLCache:
+    """A size bounded least recently used cache whose entries expire `ttl` seconds after they were set"""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict = OrderedDict()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._entries.get(key, None)
+        if entry is not None:
+            expires, value = entry
+            if expires > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._entries[key]
+        self.misses += 1
+        return default
+
+    def set(self, key: Hashable, value: Any) -> None:
+        if self.maxsize <= 0:
+            return
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        return {"size": len(self), "maxsize": self.maxsize, "ttl": self.ttl, "hits": self.hits, "misses": self.misses}
+
+
+async def get_version(db, name: str) -> int:
+    """Returns the current version counter of the named collection"""
+    document = await db[CACHE_VERSIONS_COLLECTION].find_one({"_id": name})
+    if document is None:
+        return 0
+    return document["version"]
+
+
+async def increment_version(db, name: str) -> None:
+    """Invalidates all cached results of the named collection by incrementing its version counter"""
+    await db[CACHE_VERSIONS_COLLECTION].update_one({"_id": name}, {"$inc": {"version": 1}}, upsert=True)
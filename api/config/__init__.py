@@ -1,3 +1,5 @@
+import os
+import tempfile
 from functools import lru_cache
 from typing import Any
 
@@ -17,9 +19,42 @@ class Settings(BaseSettings):
     testing: bool = False
 
     oidc_issuer: str
+    oidc_verify_tokens: bool = False
+    oidc_orcid_claim: str = "preferred_username"
+    oidc_jwks_refresh_interval: int = 3600
+    oidc_jwks_min_refresh_interval: int = 30
+    oidc_snapshot_path: str = os.path.join(tempfile.gettempdir(), "oidc_discovery.json")
     hydroshare_meta_read_url: HttpUrl
     hydroshare_file_read_url: HttpUrl
+    hydroshare_file_page_concurrency: int = 4
+    repository_http_timeout: float = 30
+    repository_http_connect_timeout: float = 5
+    repository_max_connections: int = 100
+    repository_max_connections_per_host: int = 10
+    repository_retry_attempts: int = 3
+    repository_retry_base_delay: float = 0.5
+    repository_retry_max_delay: float = 8
+    repository_breaker_failure_threshold: int = 5
+    repository_breaker_reset_timeout: float = 30
+    s3_max_workers: int = 16
+    s3_max_clients: int = 32
+    s3_max_pool_connections: int = 16
+    s3_metadata_max_size: int = 16 * 1024 * 1024
     search_relevance_score_threshold: float = 1.4
+    search_cache_size: int = 1024
+    search_cache_ttl: int = 300
+    search_facet_start_year: int = 2000
+    search_facet_max_years: int = 200
+    search_stream_batch_size: int = 100
+    search_near_default_radius: float = 10000
+    search_batch_max_size: int = 20
+    search_batch_concurrency: int = 4
+    dataset_bulk_max_size: int = 1000
+    job_workers: int = 4
+    job_poll_interval: float = 5
+    job_stale_after: int = 900
+    auth_cache_size: int = 10000
+    auth_cache_ttl: int = 60
 
     def __init__(self, **data: Any) -> None:
         super().__init__(**data)
@@ -13,12 +13,17 @@ from pydantic import ValidationError
 from starlette import status
 from starlette.responses import PlainTextResponse
 
+from api.adapters.base import circuit_breakers, http_client_pool
+from api.authentication.user import auth_scheme
 from api.config import get_settings
 from api.models.catalog import DatasetMetadataDOC
+from api.models.job import Job
 from api.models.user import Submission, User
+from api.procedures.job import job_runner
 from api.routes.catalog import router as catalog_router
 from api.routes.discovery import router as discovery_router
 from api.exceptions import RepositoryException
+from api.typeahead import typeahead_index
 
 
 app = FastAPI()
@@ -29,6 +34,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 
@@ -48,11 +54,20 @@ async def startup_db_client():
     settings = get_settings()
     app.mongodb_client = AsyncIOMotorClient(settings.db_connection_string)
     app.mongodb = app.mongodb_client[settings.database_name]
-    await init_beanie(database=app.mongodb, document_models=[DatasetMetadataDOC, User, Submission])
+    await init_beanie(database=app.mongodb, document_models=[DatasetMetadataDOC, User, Submission, Job])
+    await job_runner.start(workers=settings.job_workers, poll_interval=settings.job_poll_interval,
+                           stale_after=settings.job_stale_after)
+    app.typeahead_task = asyncio.create_task(typeahead_index.watch(app.mongodb["typeahead"]))
+    # loaded in the background so that a slow issuer does not hold up the startup, requests that need the discovery
+    # documents wait for this same load
+    auth_scheme.start_discovery()
 
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    app.typeahead_task.cancel()
+    await job_runner.stop()
+    await http_client_pool.close()
     app.mongodb_client.close()
 
 
@@ -61,6 +76,24 @@ async def health_check():
     return JSONResponse(status_code=200, content={"status": "healthy"})
 
 
+@app.get("/ready")
+async def readiness_check():
+    """Ready once the OIDC discovery documents are loaded, from the issuer or from the snapshot. The documents are
+    only needed to verify the access tokens, without verification the API is ready at once."""
+    if not auth_scheme.ready:
+        # a failed load is retried on every check until the issuer or the snapshot can be read
+        auth_scheme.start_discovery()
+        if auth_scheme.verify_tokens:
+            return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, content={"status": "not ready"})
+    return JSONResponse(status_code=200, content={"status": "ready"})
+
+
+@app.get("/repositories")
+async def repositories_status():
+    """The circuit breaker state and the request counters of each repository host"""
+    return JSONResponse(status_code=200, content=circuit_breakers.stats())
+
+
 app.include_router(catalog_router, tags=["Dataset"], prefix="/api/catalog")
 app.include_router(discovery_router, tags=["Discovery"], prefix="/api/discovery")
 
@@ -68,13 +101,24 @@ parent_dir = os.path.dirname(__file__)
 static_dir = os.path.join(parent_dir, "models/schemas")
 app.mount("/api/schemas", StaticFiles(directory=static_dir), name="schemas")
 
-openapi_schema = get_openapi(
-    title="I-GUIDE Catalog API",
-    version="1.0",
-    description="Standardized interface with validation for managing catalog",
-    routes=app.routes,
-)
-app.openapi_schema = openapi_schema
+
+def openapi():
+    """Builds the OpenAPI schema on first use. The schema is kept once the OIDC discovery documents are loaded, as
+    the security scheme flows are read from them."""
+    if app.openapi_schema:
+        return app.openapi_schema
+    openapi_schema = get_openapi(
+        title="I-GUIDE Catalog API",
+        version="1.0",
+        description="Standardized interface with validation for managing catalog",
+        routes=app.routes,
+    )
+    if auth_scheme.ready:
+        app.openapi_schema = openapi_schema
+    return openapi_schema
+
+
+app.openapi = openapi
 
 
 class Server(uvicorn.Server):
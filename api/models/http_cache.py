@@ -0,0 +1,19 @@
+from datetime import datetime
+from typing import Optional
+
+import pymongo
+from beanie import Document
+
+
+class HttpCacheEntry(Document):
+    """The validators of the last response fetched from a repository url for a scope, e.g. a submission"""
+
+    scope: str
+    url: str
+    etag: Optional[str]
+    last_modified: Optional[str]
+    fetched: datetime
+
+    class Settings:
+        name = "http_cache"
+        indexes = [pymongo.IndexModel([("scope", pymongo.ASCENDING), ("url", pymongo.ASCENDING)], unique=True)]
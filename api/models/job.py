@@ -0,0 +1,47 @@
+from datetime import datetime
+from enum import Enum
+from typing import Optional
+
+import pymongo
+from beanie import Document, PydanticObjectId
+from pydantic import Field
+
+
+class JobStatus(str, Enum):
+    PENDING = 'PENDING'
+    RUNNING = 'RUNNING'
+    SUCCEEDED = 'SUCCEEDED'
+    FAILED = 'FAILED'
+
+
+class Job(Document):
+    """A repository registration or refresh run by the background job workers. A job is `active` until it has
+    succeeded or failed, a user can have one active job per repository record."""
+
+    operation: str
+    repository: str
+    identifier: str
+    user_id: PydanticObjectId
+    status: JobStatus = JobStatus.PENDING
+    active: bool = True
+    # the id of the registered or refreshed dataset of a succeeded job
+    dataset_id: Optional[PydanticObjectId]
+    # the response status and error detail of a failed job
+    status_code: Optional[int]
+    detail: Optional[str]
+    # set by the worker that claims the job, only the worker holding the claim updates a running job
+    claim: Optional[PydanticObjectId]
+    created: datetime = Field(default_factory=datetime.utcnow)
+    updated: datetime = Field(default_factory=datetime.utcnow)
+
+    class Settings:
+        name = "jobs"
+        indexes = [
+            pymongo.IndexModel(
+                [("user_id", pymongo.ASCENDING), ("repository", pymongo.ASCENDING), ("identifier", pymongo.ASCENDING)],
+                unique=True,
+                partialFilterExpression={"active": True},
+            ),
+            # the workers claim the oldest active job
+            pymongo.IndexModel([("active", pymongo.ASCENDING), ("created", pymongo.ASCENDING)]),
+        ]
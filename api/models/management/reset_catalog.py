@@ -6,6 +6,7 @@ from motor.motor_asyncio import AsyncIOMotorClient
 
 from api.config import get_settings
 from api.models.catalog import DatasetMetadataDOC
+from api.procedures.creators import CREATORS_COLLECTION
 
 logger = logging.getLogger()
 
@@ -20,6 +21,8 @@ async def main():
     await db["discovery"].delete_many({})
     logger.info("Deleted all documents in discovery collection")
     print("Deleted all documents in discovery collection")
+    # creators are recounted by the catalog trigger as the discovery collection is repopulated
+    await db[CREATORS_COLLECTION].delete_many({})
 
     # replace all documents in catalog collection to trigger repopulating of discovery collection
     count = 0
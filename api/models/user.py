@@ -3,6 +3,7 @@ from datetime import datetime
 from enum import Enum
 from typing import List, Optional, TYPE_CHECKING
 
+import pymongo
 from beanie import Document, Link, PydanticObjectId
 from pydantic import HttpUrl, BaseModel
 
@@ -84,6 +85,15 @@ class S3Path(BaseModel):
         return f"{self.endpoint_url}+{self.bucket}+{self.path}"
 
 
+class S3Prefix(BaseModel):
+    prefix: str = ""
+    bucket: str
+    endpoint_url: HttpUrl = 'https://api.minio.cuahsi.io'
+
+    def s3_path(self, key: str) -> S3Path:
+        return S3Path(endpoint_url=self.endpoint_url, bucket=self.bucket, path=key)
+
+
 class Submission(Document):
     title: str = None
     authors: List[str] = []
@@ -94,6 +104,10 @@ class Submission(Document):
     repository_identifier: Optional[str]
     s3_path: Optional[S3Path]
 
+    class Settings:
+        indexes = [pymongo.IndexModel([("repository_identifier", pymongo.ASCENDING),
+                                       ("repository", pymongo.ASCENDING)])]
+
     @property
     def content_location(self):
         # determine the content location based on the repository type
@@ -150,11 +164,20 @@ class Submission(Document):
         return self.repository
 
 
+# index of the user id and version, the version of a user is read from the index alone
+USER_VERSION_INDEX = [("_id", pymongo.ASCENDING), ("version", pymongo.ASCENDING)]
+
+
 class User(Document):
     access_token: str
     orcid: str
     preferred_username: Optional[str]
     submissions: List[Link[Submission]] = []
+    # incremented on every write to the submissions of the user, a copy of the user with an older version is stale
+    version: int = 0
+
+    class Settings:
+        indexes = [pymongo.IndexModel(USER_VERSION_INDEX)]
 
     def submission(self, identifier: PydanticObjectId) -> Submission:
         return next(filter(lambda submission: submission.identifier == identifier, self.submissions), None)
@@ -0,0 +1,65 @@
+import re
+from typing import Dict, Iterable, List
+
+# one document per distinct creator of the discovery records, e.g. {"_id": "orcid:0000-0002-1825-0097",
+# "name": "John Doe", "tokens": ["john", "doe"], "prefixes": ["d", "do", "doe", "j", "jo", "joh", "john"], "count": 3}
+CREATORS_COLLECTION = "creators"
+CREATORS_PREFIX_INDEX = [("prefixes", 1), ("count", -1)]
+
+
+def name_tokens(name: str) -> List[str]:
+    return re.sub(r'[^\w\s]', ' ', name.lower()).split()
+
+
+def creator_key(creator: dict) -> str:
+    """Identifies a creator by ORCID when it has one, otherwise by the normalized name"""
+    identifier = creator.get('identifier') or ''
+    if isinstance(identifier, str) and 'orcid.org/' in identifier:
+        return f"orcid:{identifier.rstrip('/').rsplit('/', 1)[-1]}"
+    return f"name:{' '.join(name_tokens(creator['name']))}"
+
+
+def creator_entries(document: dict) -> Dict[str, dict]:
+    """Returns the creator entries of a catalog record keyed by creator key"""
+    entries = {}
+    for creator in document.get('creator') or []:
+        if not creator.get('name') or not name_tokens(creator['name']):
+            continue
+        entries[creator_key(creator)] = {'name': creator['name'], 'tokens': name_tokens(creator['name'])}
+    return entries
+
+
+def name_prefixes(tokens: List[str]) -> List[str]:
+    """Returns every prefix of the name tokens, a creator matches a search for any word prefix of its name"""
+    return sorted({token[:end] for token in tokens for end in range(1, len(token) + 1)})
+
+
+async def create_creators_indexes(db) -> None:
+    # the creators matching a prefix are read in count order from the index, without sorting them
+    await db[CREATORS_COLLECTION].create_index(CREATORS_PREFIX_INDEX)
+
+
+async def update_creators(db, previous_keys: Iterable[str], entries: Dict[str, dict]) -> None:
+    """Counts the creators of a written or deleted record from the difference between the creator keys of the record
+    before the write and the creators it credits after the write. `entries` has the current name of the creators
+    credited after the write, creators that are no longer credited by any record are removed."""
+    previous_keys = set(previous_keys)
+    for key, entry in entries.items():
+        update = {"$set": {**entry, "prefixes": name_prefixes(entry["tokens"])}}
+        if key in previous_keys:
+            await db[CREATORS_COLLECTION].update_one({"_id": key}, update)
+        else:
+            await db[CREATORS_COLLECTION].update_one({"_id": key}, {**update, "$inc": {"count": 1}}, upsert=True)
+    for key in previous_keys.difference(entries):
+        await db[CREATORS_COLLECTION].update_one({"_id": key}, {"$inc": {"count": -1}})
+        await db[CREATORS_COLLECTION].delete_one({"_id": key, "count": {"$lte": 0}})
+
+
+async def search_creators(db, name: str, limit: int) -> List[str]:
+    """Returns the names of the creators with a name word starting with each word of `name`, most credited first"""
+    tokens = name_tokens(name)
+    if not tokens:
+        return []
+    creators = db[CREATORS_COLLECTION].find({"prefixes": {"$all": tokens}}, {"name": 1})
+    creators = await creators.sort("count", -1).hint(CREATORS_PREFIX_INDEX).limit(limit).to_list(limit)
+    return [creator["name"] for creator in creators]
@@ -0,0 +1,156 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from beanie import PydanticObjectId
+from beanie.odm.operators.find.logical import Or
+from beanie.odm.operators.update.general import Set
+from beanie.odm.queries.update import UpdateResponse
+from fastapi import HTTPException, status
+from pymongo import ASCENDING
+from pymongo.errors import DuplicateKeyError
+
+from api.exceptions import RepositoryException
+from api.models.catalog import DatasetMetadataDOC
+from api.models.job import Job, JobStatus
+from api.models.user import User
+
+logger = logging.getLogger()
+
+JobHandler = Callable[[str, User], Awaitable[DatasetMetadataDOC]]
+
+
+class _JobRunner:
+    """Runs the jobs in the job collection with a pool of worker tasks. The workers of every API instance claim the
+    jobs from the collection, a job added by one instance may be run by another. The handler of a job operation is
+    called with the identifier of the repository record and the user, and returns the registered or refreshed
+    dataset."""
+
+    def __init__(self):
+        self._handlers: Dict[str, JobHandler] = {}
+        self._workers: List[asyncio.Task] = []
+        self._job_added: Optional[asyncio.Event] = None
+        self._poll_interval = 0.0
+        self._stale_after = timedelta()
+
+    def register(self, operation: str, handler: JobHandler) -> None:
+        self._handlers[operation] = handler
+
+    async def submit(self, operation: str, repository: str, identifier: str, user: User) -> Job:
+        """Adds a job, or returns the active job of the user for the same repository record"""
+        while True:
+            job = Job(operation=operation, repository=repository, identifier=identifier, user_id=user.id)
+            try:
+                await job.insert()
+            except DuplicateKeyError:
+                active_job = await Job.find_one(Job.user_id == user.id, Job.repository == repository,
+                                                Job.identifier == identifier, Job.active == True)  # noqa: E712
+                if active_job is not None:
+                    return active_job
+                # the active job finished in the meantime
+                continue
+            # wakes up the workers of this instance, the other instances find the job when they next poll
+            self._job_added.set()
+            return job
+
+    async def start(self, workers: int, poll_interval: float, stale_after: int) -> None:
+        """Starts the workers. Idle workers look for jobs every `poll_interval` seconds. A running job is touched
+        several times every `stale_after` seconds, a job that has not been touched for longer is run again, as the
+        instance running it stopped before it finished."""
+        self._job_added = asyncio.Event()
+        self._poll_interval = poll_interval
+        self._stale_after = timedelta(seconds=stale_after)
+        self._workers = [asyncio.create_task(self._work()) for _ in range(workers)]
+
+    def _runnable(self) -> tuple:
+        """The query criteria of the jobs a worker can run"""
+        stale = datetime.utcnow() - self._stale_after
+        return Job.active == True, Or(Job.status == JobStatus.PENDING, Job.updated < stale)  # noqa: E712
+
+    async def stop(self) -> None:
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def _work(self) -> None:
+        while True:
+            self._job_added.clear()
+            try:
+                job = await self._claim()
+            except Exception as exp:
+                logger.exception(f"Jobs could not be claimed.\n Error:{str(exp)}")
+                job = None
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._job_added.wait(), timeout=self._poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            try:
+                await self._run(job)
+            except Exception as exp:
+                logger.exception(f"Job {job.id} could not be run.\n Error:{str(exp)}")
+
+    async def _claim(self) -> Optional[Job]:
+        """Claims the oldest runnable job with a single update, so that a job is run by one worker of one instance"""
+        return await Job.find_one(*self._runnable()).update(
+            Set({Job.status: JobStatus.RUNNING, Job.claim: PydanticObjectId(), Job.updated: datetime.utcnow()}),
+            response_type=UpdateResponse.NEW_DOCUMENT,
+            sort=[(Job.created, ASCENDING)],
+        )
+
+    def _claimed(self, job: Job):
+        """Matches the job while the worker that runs it holds the claim"""
+        return Job.find_one(Job.id == job.id, Job.claim == job.claim)
+
+    async def _heartbeat(self, job: Job) -> None:
+        """Touches the running job, so that it is not run again by another worker while it is still running"""
+        interval = self._stale_after.total_seconds() / 3
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                touched = await self._claimed(job).update(Set({Job.updated: datetime.utcnow()}))
+            except Exception as exp:
+                logger.exception(f"Job {job.id} could not be touched.\n Error:{str(exp)}")
+                continue
+            if not touched.matched_count:
+                logger.warning(f"Job {job.id} was claimed by another worker while it was running")
+                return
+
+    async def _run(self, job: Job) -> None:
+        heartbeat = asyncio.create_task(self._heartbeat(job))
+        try:
+            user = await User.get(job.user_id)
+            await user.fetch_all_links()
+            dataset = await self._handlers[job.operation](job.identifier, user)
+            job.status = JobStatus.SUCCEEDED
+            job.dataset_id = dataset.id
+        except (HTTPException, RepositoryException) as exp:
+            job.status = JobStatus.FAILED
+            job.status_code = exp.status_code
+            job.detail = str(exp.detail)
+        except Exception as exp:
+            logger.exception(f"Job {job.id} failed.\n Error:{str(exp)}")
+            job.status = JobStatus.FAILED
+            job.status_code = status.HTTP_500_INTERNAL_SERVER_ERROR
+            job.detail = "Internal server error"
+        finally:
+            heartbeat.cancel()
+        job.active = False
+        job.updated = datetime.utcnow()
+        # the job is only completed by the worker that holds the claim
+        completed = await self._claimed(job).update(Set({
+            Job.status: job.status,
+            Job.dataset_id: job.dataset_id,
+            Job.status_code: job.status_code,
+            Job.detail: job.detail,
+            Job.active: job.active,
+            Job.updated: job.updated,
+        }))
+        if not completed.matched_count:
+            logger.warning(f"Job {job.id} was claimed by another worker, its {job.status} result is not saved")
+
+
+job_runner = _JobRunner()
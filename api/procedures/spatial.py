@@ -0,0 +1,52 @@
+from typing import List, Optional, Tuple
+
+
+def _longitude_ranges(west: float, east: float) -> List[Tuple[float, float]]:
+    """Splits the longitudes of a box into ranges that do not cross the antimeridian and are narrower than 180
+    degrees, so that each edge of a range is the shorter way around the sphere. A box with west greater than east
+    crosses the antimeridian."""
+    ranges = [(west, 180), (-180, east)] if west > east else [(west, east)]
+    # a box that ends on the antimeridian has a range without width
+    ranges = [(start, end) for start, end in ranges if end > start] or ranges[:1]
+    split = []
+    for start, end in ranges:
+        parts = int((end - start) // 180) + 1
+        width = (end - start) / parts
+        boundaries = [start, *(start + width * part for part in range(1, parts)), end]
+        split.extend(zip(boundaries, boundaries[1:]))
+    return split
+
+
+def box_geometry(west: float, south: float, east: float, north: float) -> dict:
+    """Returns the GeoJSON geometry of a bounding box, boxes without area become a point or a line. Boxes crossing the
+    antimeridian or 180 degrees wide or wider become a MultiPolygon (or a MultiLineString)."""
+    if west == east and south == north:
+        return {"type": "Point", "coordinates": [west, south]}
+    if west == east:
+        return {"type": "LineString", "coordinates": [[west, south], [east, north]]}
+    ranges = _longitude_ranges(west, east)
+    if south == north:
+        lines = [[[start, south], [end, north]] for start, end in ranges]
+        if len(lines) == 1:
+            return {"type": "LineString", "coordinates": lines[0]}
+        return {"type": "MultiLineString", "coordinates": lines}
+    rings = [
+        [[start, south], [end, south], [end, north], [start, north], [start, south]] for start, end in ranges
+    ]
+    if len(rings) == 1:
+        return {"type": "Polygon", "coordinates": rings}
+    return {"type": "MultiPolygon", "coordinates": [[ring] for ring in rings]}
+
+
+def spatial_coverage_geometry(spatial_coverage: Optional[dict]) -> Optional[dict]:
+    """Converts the geo of a catalog record spatialCoverage, a GeoShape box ("N E S W") or GeoCoordinates, to a
+    GeoJSON geometry that can be indexed for geospatial search"""
+    geo = (spatial_coverage or {}).get("geo")
+    if not geo:
+        return None
+    if geo.get("box"):
+        north, east, south, west = (float(value) for value in geo["box"].split())
+        return box_geometry(west, south, east, north)
+    if geo.get("latitude") is not None and geo.get("longitude") is not None:
+        return {"type": "Point", "coordinates": [float(geo["longitude"]), float(geo["latitude"])]}
+    return None
@@ -1,13 +1,12 @@
 import json
 
-from beanie import DeleteRules, WriteRules
-
 from api.models.user import User
+from api.procedures.user import add_submissions, remove_submission
 
 
 async def delete_submission(identifier: str, user: User):
     submission = user.submission(identifier)
-    await submission.delete(link_rule=DeleteRules.DELETE_LINKS)
+    await remove_submission(user, submission)
 
 
 async def create_or_update_submission(identifier, record, user: User, metadata_json):
@@ -17,5 +16,4 @@ async def create_or_update_submission(identifier, record, user: User, metadata_j
     if existing_submission:
         await existing_submission.set(submission.dict(exclude_unset=True))
     else:
-        user.submissions.append(submission)
-        await user.save(link_rule=WriteRules.WRITE)
+        await add_submissions(user, [submission])
@@ -1,9 +1,21 @@
-from beanie.odm.operators.update.general import Set
+from typing import List
 
-from api.models.user import User
+from beanie import PydanticObjectId
+from beanie.odm.operators.update.array import Pull, Push
+from beanie.odm.operators.update.general import Inc, Set
+from beanie.odm.utils.dump import get_dict
+from bson import DBRef
+from pymongo import ReplaceOne
+
+from api.models.user import USER_VERSION_INDEX, Submission, User
 
 
 async def create_or_update_user(orcid: str, access_token: str) -> User:
+    user = await User.find_one(User.orcid == orcid)
+    if user is not None and user.access_token == access_token:
+        # the user has not logged in again since the last request, there is nothing to write
+        await user.fetch_all_links()
+        return user
     await User.find_one(User.orcid == orcid).upsert(
         Set({'orcid': orcid, 'access_token': access_token}), on_insert=User(orcid=orcid, access_token=access_token)
     )
@@ -13,4 +25,61 @@ async def create_or_update_user(orcid: str, access_token: str) -> User:
 
 
 async def get_user(access_token: str) -> User:
-    return await User.find_one(User.access_token == access_token)
\ No newline at end of file
+    return await User.find_one(User.access_token == access_token)
+
+
+async def user_version(user_id: PydanticObjectId) -> int:
+    """Returns the version of the user, read from the user version index without reading the user document"""
+    document = await User.get_motor_collection().find_one(
+        {"_id": user_id}, {"_id": 0, "version": 1}, hint=USER_VERSION_INDEX
+    )
+    return (document or {}).get("version", 0)
+
+
+def submission_link(submission: Submission) -> DBRef:
+    return DBRef(Submission.get_motor_collection().name, submission.id)
+
+
+async def add_submissions(user: User, submissions: List[Submission]) -> None:
+    """Inserts the submissions and links them to the user with a single update of the user document, the other
+    submissions of the user are not written"""
+    if not submissions:
+        return
+    for submission in submissions:
+        if submission.id is None:
+            submission.id = PydanticObjectId()
+    await Submission.insert_many(submissions)
+    links = [submission_link(submission) for submission in submissions]
+    await User.find_one(User.id == user.id).update(Push({User.submissions: {"$each": links}}), Inc({User.version: 1}))
+    user.version += 1
+    user.submissions.extend(submissions)
+
+
+async def remove_submission(user: User, submission: Submission) -> None:
+    """Unlinks the submission from the user with a single update of the user document and deletes it"""
+    await User.find_one(User.id == user.id).update(Pull({User.submissions: submission_link(submission)}),
+                                                   Inc({User.version: 1}))
+    user.version += 1
+    await submission.delete()
+    user.submissions = [linked for linked in user.submissions if linked.id != submission.id]
+
+
+async def replace_submission(user: User, submission: Submission) -> None:
+    """Replaces the submission document and the user's copy of it"""
+    await submission.replace()
+    await User.find_one(User.id == user.id).update(Inc({User.version: 1}))
+    user.version += 1
+    user.submissions = [submission if linked.id == submission.id else linked for linked in user.submissions]
+
+
+async def replace_submissions(user: User, submissions: List[Submission]) -> None:
+    """Replaces the submission documents with a single bulk write and the user's copies of them"""
+    if not submissions:
+        return
+    await Submission.get_motor_collection().bulk_write(
+        [ReplaceOne({"_id": submission.id}, get_dict(submission, to_db=True)) for submission in submissions]
+    )
+    await User.find_one(User.id == user.id).update(Inc({User.version: 1}))
+    user.version += 1
+    replaced_by_id = {submission.id: submission for submission in submissions}
+    user.submissions = [replaced_by_id.get(linked.id, linked) for linked in user.submissions]
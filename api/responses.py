@@ -0,0 +1,30 @@
+from typing import Any
+
+import orjson
+from fastapi.responses import Response
+
+
+def dumps(content: Any) -> bytes:
+    """Serializes mongo query results straight to JSON bytes. ObjectId, datetime and any other BSON value orjson
+    does not support natively are written with str(), the format clients of the search endpoints already parse."""
+    return orjson.dumps(content, default=str, option=orjson.OPT_PASSTHROUGH_DATETIME)
+
+
+class BSONJSONResponse(Response):
+    """JSON response for raw mongo documents that are not validated by a response model"""
+
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        if isinstance(content, bytes):
+            # already serialized, e.g. cached
+            return content
+        return dumps(content)
+
+
+class DocumentJSONResponse(BSONJSONResponse):
+    """JSON response for raw catalog documents, datetime values are written in ISO 8601 like the response models
+    write them"""
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, default=str)
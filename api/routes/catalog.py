@@ -1,14 +1,41 @@
-from typing import Annotated, List
-
-from beanie import PydanticObjectId, WriteRules
-from fastapi import APIRouter, Depends, HTTPException, status
+import asyncio
+import logging
+from typing import Annotated, List, Optional, Tuple
+
+import orjson
+from beanie import PydanticObjectId
+from beanie.odm.utils.dump import get_dict
+from beanie.operators import In
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
+from pydantic import ValidationError
+from pymongo import ASCENDING, InsertOne, ReplaceOne
+from pymongo.errors import BulkWriteError
+from starlette.concurrency import run_in_threadpool
 
 from api.adapters.utils import get_adapter_by_type, RepositoryType
 from api.authentication.user import get_current_user
+from api.config import get_settings
+from api.exceptions import RepositoryException
 from api.models.catalog import DatasetMetadataDOC
-from api.models.user import Submission, SubmissionType, User, S3Path
+from api.models.job import Job
+from api.models.user import Submission, SubmissionType, User, S3Path, S3Prefix
+from api.procedures.job import job_runner
+from api.procedures.user import add_submissions, remove_submission, replace_submission, replace_submissions
+from api.responses import DocumentJSONResponse
 
 router = APIRouter()
+logger = logging.getLogger()
+
+# response header with the cursor of the next page of a paginated listing
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+# number of records of a bulk request validated by a single worker thread
+BULK_VALIDATION_CHUNK_SIZE = 100
+# operations of the background registration jobs
+HYDROSHARE_REGISTER_JOB = "hydroshare_register"
+HYDROSHARE_REFRESH_JOB = "hydroshare_refresh"
+# mongo error code of a write that violates a unique index
+DUPLICATE_KEY_ERROR = 11000
 
 
 def inject_repository_identifier(submission: Submission, document: DatasetMetadataDOC):
@@ -31,16 +58,80 @@ def inject_submission_s3_path(submission: Submission, document: DatasetMetadataD
     return document
 
 
+def inject_submission_fields(submission: Submission, document: DatasetMetadataDOC):
+    document = inject_repository_identifier(submission, document)
+    document = inject_submission_type(submission, document)
+    document = inject_submission_s3_path(submission, document)
+    return document
+
+
 @router.post("/dataset/", response_model=DatasetMetadataDOC, status_code=status.HTTP_201_CREATED)
 async def create_dataset(document: DatasetMetadataDOC, user: Annotated[User, Depends(get_current_user)]):
     await document.insert()
     submission = document.as_submission()
-    user.submissions.append(submission)
-    await user.save(link_rule=WriteRules.WRITE)
+    await add_submissions(user, [submission])
     document = inject_submission_type(submission, document)
     return document
 
 
+@router.post("/dataset/bulk", status_code=status.HTTP_207_MULTI_STATUS)
+async def bulk_create_or_update_datasets(request: Request, user: Annotated[User, Depends(get_current_user)]):
+    """Creates or updates many datasets with a few database writes. The body is a JSON array of dataset records or
+    NDJSON with one dataset record per line. A record with the `_id` of a dataset of the user updates that dataset,
+    any other record creates a new dataset. Returns the status of each record in the order of the records."""
+    records = await _read_bulk_records(request)
+    results = await _validate_bulk_records(records)
+
+    dataset_writes = []
+    # the index of the record, the submission of the dataset and whether it is new, of each dataset write
+    written = []
+    seen_ids = set()
+    for index, result in enumerate(results):
+        if not isinstance(result, DatasetMetadataDOC):
+            continue
+        document = result
+        if document.id is None:
+            document.id = PydanticObjectId()
+            dataset_writes.append(InsertOne(get_dict(document, to_db=True)))
+            written.append((index, document.as_submission(), True))
+            results[index] = {"index": index, "status": status.HTTP_201_CREATED, "_id": str(document.id)}
+            continue
+
+        submission = user.submission(document.id)
+        if submission is None:
+            results[index] = {"index": index, "status": status.HTTP_404_NOT_FOUND,
+                              "detail": "Dataset metadata record was not found"}
+            continue
+        if document.id in seen_ids:
+            results[index] = {"index": index, "status": status.HTTP_409_CONFLICT, "detail": "Duplicate dataset record"}
+            continue
+        seen_ids.add(document.id)
+        dataset_writes.append(ReplaceOne({"_id": document.id}, get_dict(document, to_db=True)))
+        updated_submission = document.as_submission()
+        updated_submission.id = submission.id
+        updated_submission.repository_identifier = submission.repository_identifier
+        updated_submission.repository = submission.repository
+        updated_submission.submitted = submission.submitted
+        updated_submission.s3_path = submission.s3_path
+        written.append((index, updated_submission, False))
+        results[index] = {"index": index, "status": status.HTTP_200_OK, "_id": str(document.id)}
+
+    write_errors = await _bulk_write_datasets(dataset_writes)
+    new_submissions = []
+    updated_submissions = []
+    for position, (index, submission, is_new) in enumerate(written):
+        if position in write_errors:
+            results[index] = {"index": index, **write_errors[position]}
+        elif is_new:
+            new_submissions.append(submission)
+        else:
+            updated_submissions.append(submission)
+
+    await replace_submissions(user, updated_submissions)
+    await add_submissions(user, new_submissions)
+    return results
+
+
 @router.get("/dataset/{submission_id}", response_model=DatasetMetadataDOC, response_model_exclude_none=True)
 async def get_dataset(submission_id: PydanticObjectId):
     submission: Submission = await Submission.find_one(Submission.identifier == submission_id)
@@ -51,29 +142,46 @@ async def get_dataset(submission_id: PydanticObjectId):
     if document is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Dataset metadata record was not found")
 
-    document = inject_repository_identifier(submission, document)
-    document = inject_submission_type(submission, document)
-    document = inject_submission_s3_path(submission, document)
+    document = inject_submission_fields(submission, document)
     return document
 
 
 @router.get("/dataset/", response_model=List[DatasetMetadataDOC], response_model_exclude_none=True)
-async def get_datasets(user: Annotated[User, Depends(get_current_user)]):
-    documents = [
-        inject_repository_identifier(
-            submission, await DatasetMetadataDOC.get(submission.identifier)
-        )
-        for submission in user.submissions
-    ]
-    documents = [
-        inject_submission_type(submission, document)
-        for submission, document in zip(user.submissions, documents)
-    ]
-    documents = [
-        inject_submission_s3_path(submission, document)
-        for submission, document in zip(user.submissions, documents)
+async def get_datasets(
+    user: Annotated[User, Depends(get_current_user)],
+    response: Response,
+    limit: Optional[int] = Query(default=None, gt=0),
+    cursor: Optional[PydanticObjectId] = None,
+    fields: Optional[str] = None,
+):
+    """Returns the datasets of the user. With `limit` the datasets are paginated, the cursor of the next page is
+    returned in the X-Next-Cursor header. `fields` is a comma separated list of the dataset fields to return, only
+    those fields are read from the database."""
+    submissions, next_cursor = _paginate(user.submissions, limit, cursor)
+    if next_cursor is not None:
+        response.headers[NEXT_CURSOR_HEADER] = str(next_cursor)
+    # fetch all the datasets of the page with a single query
+    identifiers = [submission.identifier for submission in submissions]
+
+    if fields:
+        projection = _projection(fields, DatasetMetadataDOC)
+        collection = DatasetMetadataDOC.get_motor_collection()
+        documents = await collection.find({"_id": {"$in": identifiers}}, projection).to_list(None)
+        documents_by_id = {document["_id"]: document for document in documents}
+        documents = [
+            _inject_submission_fields_raw(submission, documents_by_id[submission.identifier], projection)
+            for submission in submissions
+            if submission.identifier in documents_by_id
+        ]
+        return DocumentJSONResponse(documents, headers=dict(response.headers))
+
+    documents = await DatasetMetadataDOC.find(In(DatasetMetadataDOC.id, identifiers)).to_list()
+    documents_by_id = {document.id: document for document in documents}
+    return [
+        inject_submission_fields(submission, documents_by_id[submission.identifier])
+        for submission in submissions
+        if submission.identifier in documents_by_id
     ]
-    return documents
 
 
 @router.put("/dataset/{submission_id}", response_model=DatasetMetadataDOC)
@@ -90,7 +198,8 @@ async def update_dataset(
     if dataset is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Dataset metadata record was not found")
 
-    dataset = await _update_dataset(updated_document=updated_document, original_document=dataset, submission=submission)
+    dataset = await _update_dataset(updated_document=updated_document, original_document=dataset, submission=submission,
+                                    user=user)
     return dataset
 
 
@@ -102,45 +211,70 @@ async def delete_dataset(submission_id: PydanticObjectId, user: Annotated[User,
     dataset: DatasetMetadataDOC = await DatasetMetadataDOC.get(submission.identifier)
     if dataset is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Dataset metadata record was not found")
-    user.submissions.remove(submission)
-    await user.save(link_rule=WriteRules.WRITE)
-    await submission.delete()
+    await remove_submission(user, submission)
     await dataset.delete()
     return {"deleted_dataset_id": submission_id}
 
 
 @router.get("/submission/", response_model=List[Submission])
-async def get_submissions(user: Annotated[User, Depends(get_current_user)]):
-    return user.submissions
-
+async def get_submissions(
+    user: Annotated[User, Depends(get_current_user)],
+    response: Response,
+    limit: Optional[int] = Query(default=None, gt=0),
+    cursor: Optional[PydanticObjectId] = None,
+    fields: Optional[str] = None,
+):
+    """Returns the submissions of the user in the order they were submitted. With `limit` the submissions are
+    paginated, the cursor of the next page is the id of the last submission of the page and is returned in the
+    X-Next-Cursor header. `fields` is a comma separated list of the submission fields to return, only those fields
+    are read from the database."""
+    query = {"_id": {"$in": [submission.id for submission in user.submissions]}}
+    if cursor is not None:
+        query["_id"]["$gt"] = cursor
+    projection = _projection(fields, Submission) if fields else None
+    submissions = Submission.get_motor_collection().find(query, projection).sort("_id", ASCENDING)
+    if limit is not None:
+        # one more than the page, to know whether there is a next page
+        submissions = submissions.limit(limit + 1)
+    submissions = await submissions.to_list(None)
+    if limit is not None and len(submissions) > limit:
+        submissions = submissions[:limit]
+        response.headers[NEXT_CURSOR_HEADER] = str(submissions[-1]["_id"])
+    if fields:
+        return DocumentJSONResponse(submissions, headers=dict(response.headers))
+    return [Submission.parse_obj(submission) for submission in submissions]
+
+
+@router.get("/repository/hydroshare/{identifier}", response_model=DatasetMetadataDOC,
+            responses={status.HTTP_202_ACCEPTED: {"model": Job}})
+async def register_hydroshare_resource_metadata(
+    identifier: str,
+    user: Annotated[User, Depends(get_current_user)],
+    job: Annotated[bool, Query(description="Register in a background job and return the job")] = False,
+):
+    if job:
+        return await _submit_job(HYDROSHARE_REGISTER_JOB, RepositoryType.HYDROSHARE, identifier, user)
+    return await _register_hydroshare_resource(identifier, user)
 
-@router.get("/repository/hydroshare/{identifier}", response_model=DatasetMetadataDOC)
-async def register_hydroshare_resource_metadata(identifier: str, user: Annotated[User, Depends(get_current_user)]):
-    # check that the user has not already registered this resource
-    submission: Submission = user.submission_by_repository(repo_type=RepositoryType.HYDROSHARE, identifier=identifier)
-    if submission is not None:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="This resource has already been submitted by this user",
-        )
-    dataset: DatasetMetadataDOC = await _save_to_db(repository_type=RepositoryType.HYDROSHARE,
-                                                    identifier=identifier, user=user)
-    return dataset
 
+@router.put("/repository/hydroshare/{identifier}", response_model=DatasetMetadataDOC,
+            responses={status.HTTP_202_ACCEPTED: {"model": Job}})
+async def refresh_dataset_from_hydroshare(
+    identifier: str,
+    user: Annotated[User, Depends(get_current_user)],
+    job: Annotated[bool, Query(description="Refresh in a background job and return the job")] = False,
+):
+    if job:
+        return await _submit_job(HYDROSHARE_REFRESH_JOB, RepositoryType.HYDROSHARE, identifier, user)
+    return await _refresh_hydroshare_resource(identifier, user)
 
-@router.put("/repository/hydroshare/{identifier}", response_model=DatasetMetadataDOC)
-async def refresh_dataset_from_hydroshare(identifier: str, user: Annotated[User, Depends(get_current_user)]):
-    submission: Submission = user.submission_by_repository(repo_type=RepositoryType.HYDROSHARE, identifier=identifier)
-    if submission is None:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Dataset metadata record was not found")
 
-    dataset: DatasetMetadataDOC = await DatasetMetadataDOC.get(submission.identifier)
-    if dataset is None:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Dataset metadata record was not found")
-
-    dataset = await _save_to_db(repository_type=RepositoryType.HYDROSHARE, identifier=identifier,
-                                user=user, submission=submission)
-    return dataset
+@router.get("/jobs/{job_id}", response_model=Job)
+async def get_job(job_id: PydanticObjectId, user: Annotated[User, Depends(get_current_user)]):
+    job: Job = await Job.get(job_id)
+    if job is None or job.user_id != user.id:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job was not found")
+    return job
 
 
 @router.put("/repository/s3", response_model=DatasetMetadataDOC)
@@ -160,6 +294,71 @@ async def register_s3_dataset(s3_path: S3Path, user: Annotated[User, Depends(get
     return dataset
 
 
+@router.put("/repository/s3/prefix", status_code=status.HTTP_207_MULTI_STATUS)
+async def register_s3_prefix(s3_prefix: S3Prefix, user: Annotated[User, Depends(get_current_user)]):
+    """User provides a bucket prefix. The metadata of every JSON file under the prefix is fetched from S3 concurrently
+    and saved to the catalog with a few database writes. Files already registered by the user are skipped. Returns
+    the status of each file in the order the files are listed."""
+
+    adapter = get_adapter_by_type(repository_type=RepositoryType.S3)
+    keys = await adapter.list_metadata_files(s3_prefix.endpoint_url, s3_prefix.bucket, s3_prefix.prefix,
+                                             max_keys=get_settings().dataset_bulk_max_size)
+    s3_paths = [s3_prefix.s3_path(key) for key in keys]
+    registered = await _registered_identifiers(user, RepositoryType.S3, [s3_path.identifier for s3_path in s3_paths])
+
+    results = {}
+    new_s3_paths = []
+    for s3_path in s3_paths:
+        if s3_path.identifier in registered:
+            results[s3_path.path] = {"key": s3_path.path, "status": status.HTTP_409_CONFLICT,
+                                     "detail": "This S3 dataset has already been submitted by this user"}
+        else:
+            new_s3_paths.append(s3_path)
+
+    fetched = await asyncio.gather(*[adapter.get_metadata(s3_path.fetch_identifier) for s3_path in new_s3_paths],
+                                   return_exceptions=True)
+    fetched_s3_paths = []
+    records = []
+    for s3_path, metadata in zip(new_s3_paths, fetched):
+        if isinstance(metadata, RepositoryException):
+            results[s3_path.path] = {"key": s3_path.path, "status": metadata.status_code, "detail": metadata.detail}
+        elif isinstance(metadata, Exception):
+            # an unexpected error fails this key only, the other keys are still registered
+            logger.error(f"Failed to fetch S3 metadata file {s3_path.fetch_identifier}", exc_info=metadata)
+            results[s3_path.path] = {"key": s3_path.path, "status": status.HTTP_500_INTERNAL_SERVER_ERROR,
+                                     "detail": "Internal server error"}
+        elif isinstance(metadata, BaseException):
+            raise metadata
+        else:
+            fetched_s3_paths.append(s3_path)
+            records.append(metadata)
+
+    dataset_writes = []
+    # the S3 path and the submission of each dataset write
+    written = []
+    for s3_path, result in zip(fetched_s3_paths, await _validate_bulk_records(records)):
+        if not isinstance(result, DatasetMetadataDOC):
+            results[s3_path.path] = {"key": s3_path.path, "status": result["status"], "detail": result["detail"]}
+            continue
+        document = result
+        document.id = PydanticObjectId()
+        dataset_writes.append(InsertOne(get_dict(document, to_db=True)))
+        submission = adapter.update_submission(submission=document.as_submission(), repo_record_id=s3_path.identifier)
+        submission.s3_path = s3_path
+        written.append((s3_path, submission))
+        results[s3_path.path] = {"key": s3_path.path, "status": status.HTTP_201_CREATED, "_id": str(document.id)}
+
+    write_errors = await _bulk_write_datasets(dataset_writes)
+    new_submissions = []
+    for position, (s3_path, submission) in enumerate(written):
+        if position in write_errors:
+            results[s3_path.path] = {"key": s3_path.path, **write_errors[position]}
+        else:
+            new_submissions.append(submission)
+    await add_submissions(user, new_submissions)
+    return [results[s3_path.path] for s3_path in s3_paths]
+
+
 @router.post("/dataset-s3/", response_model=DatasetMetadataDOC, status_code=status.HTTP_201_CREATED)
 async def create_dataset_s3(
         s3_path: S3Path,
@@ -182,11 +381,8 @@ async def create_dataset_s3(
     submission.repository_identifier = identifier
     submission.repository = RepositoryType.S3
     submission.s3_path = s3_path
-    user.submissions.append(submission)
-    await user.save(link_rule=WriteRules.WRITE)
-    document = inject_repository_identifier(submission, document)
-    document = inject_submission_type(submission, document)
-    document = inject_submission_s3_path(submission, document)
+    await add_submissions(user, [submission])
+    document = inject_submission_fields(submission, document)
     return document
 
 
@@ -217,10 +413,47 @@ async def update_dataset_s3(
 
     submission.repository_identifier = identifier
     submission.s3_path = s3_path
-    dataset = await _update_dataset(updated_document=document, original_document=dataset, submission=submission)
+    dataset = await _update_dataset(updated_document=document, original_document=dataset, submission=submission,
+                                    user=user)
     return dataset
 
 
+async def _register_hydroshare_resource(identifier: str, user: User) -> DatasetMetadataDOC:
+    # check that the user has not already registered this resource
+    submission: Submission = user.submission_by_repository(repo_type=RepositoryType.HYDROSHARE, identifier=identifier)
+    if submission is not None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="This resource has already been submitted by this user",
+        )
+    dataset: DatasetMetadataDOC = await _save_to_db(repository_type=RepositoryType.HYDROSHARE,
+                                                    identifier=identifier, user=user)
+    return dataset
+
+
+async def _refresh_hydroshare_resource(identifier: str, user: User) -> DatasetMetadataDOC:
+    submission: Submission = user.submission_by_repository(repo_type=RepositoryType.HYDROSHARE, identifier=identifier)
+    if submission is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Dataset metadata record was not found")
+
+    dataset: DatasetMetadataDOC = await DatasetMetadataDOC.get(submission.identifier)
+    if dataset is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Dataset metadata record was not found")
+
+    dataset = await _save_to_db(repository_type=RepositoryType.HYDROSHARE, identifier=identifier,
+                                user=user, submission=submission)
+    return dataset
+
+
+job_runner.register(HYDROSHARE_REGISTER_JOB, _register_hydroshare_resource)
+job_runner.register(HYDROSHARE_REFRESH_JOB, _refresh_hydroshare_resource)
+
+
+async def _submit_job(operation: str, repository_type: RepositoryType, identifier: str, user: User) -> Response:
+    job = await job_runner.submit(operation=operation, repository=repository_type, identifier=identifier, user=user)
+    return DocumentJSONResponse(job.dict(by_alias=True), status_code=status.HTTP_202_ACCEPTED)
+
+
 async def _save_to_db(repository_type: RepositoryType, identifier: str, user: User, submission: Submission = None):
     adapter = get_adapter_by_type(repository_type=repository_type)
     # fetch metadata from repository as catalog dataset
@@ -236,8 +469,7 @@ async def _save_to_db(repository_type: RepositoryType, identifier: str, user: Us
         submission = repo_dataset.as_submission()
         submission = adapter.update_submission(submission=submission, repo_record_id=identifier)
         submission.s3_path = s3_path
-        user.submissions.append(submission)
-        await user.save(link_rule=WriteRules.WRITE)
+        await add_submissions(user, [submission])
         dataset = repo_dataset
     else:
         # update existing registration
@@ -250,16 +482,27 @@ async def _save_to_db(repository_type: RepositoryType, identifier: str, user: Us
         updated_submission.id = submission.id
         updated_submission.submitted = submission.submitted
         updated_submission.s3_path = s3_path
-        await updated_submission.replace()
+        await replace_submission(user, updated_submission)
         dataset = updated_dataset
         submission = updated_submission
 
-    dataset = inject_repository_identifier(submission, dataset)
-    dataset = inject_submission_type(submission, dataset)
-    dataset = inject_submission_s3_path(submission, dataset)
+    dataset = inject_submission_fields(submission, dataset)
     return dataset
 
 
+async def _registered_identifiers(user: User, repository_type: RepositoryType, identifiers: List[str]) -> set:
+    """Returns the repository identifiers of the user's submissions that are in `identifiers`, looked up with a
+    single query on the repository identifier index"""
+    if not identifiers:
+        return set()
+    submissions = await Submission.find(
+        In(Submission.repository_identifier, identifiers),
+        Submission.repository == repository_type,
+        In(Submission.id, [submission.id for submission in user.submissions]),
+    ).to_list()
+    return {submission.repository_identifier for submission in submissions}
+
+
 async def _get_repo_meta_as_catalog_record(adapter, identifier: str):
     metadata = await adapter.get_metadata(identifier)
     catalog_dataset: DatasetMetadataDOC = adapter.to_catalog_record(metadata)
@@ -267,7 +510,7 @@ async def _get_repo_meta_as_catalog_record(adapter, identifier: str):
 
 
 async def _update_dataset(updated_document: DatasetMetadataDOC, original_document: DatasetMetadataDOC,
-                          submission: Submission):
+                          submission: Submission, user: User):
     updated_document.id = original_document.id
     await updated_document.replace()
     dataset: DatasetMetadataDOC = await DatasetMetadataDOC.get(original_document.id)
@@ -277,8 +520,108 @@ async def _update_dataset(updated_document: DatasetMetadataDOC, original_documen
     updated_submission.repository = submission.repository
     updated_submission.submitted = submission.submitted
     updated_submission.s3_path = submission.s3_path
-    await updated_submission.replace()
-    dataset = inject_repository_identifier(updated_submission, dataset)
-    dataset = inject_submission_type(updated_submission, dataset)
-    dataset = inject_submission_s3_path(updated_submission, dataset)
+    await replace_submission(user, updated_submission)
+    dataset = inject_submission_fields(updated_submission, dataset)
     return dataset
+
+
+def _paginate(
+    submissions: List[Submission], limit: Optional[int], cursor: Optional[PydanticObjectId]
+) -> Tuple[List[Submission], Optional[PydanticObjectId]]:
+    """Returns the page of submissions after the submission identified by `cursor` and the cursor of the next page"""
+    start = 0
+    if cursor is not None:
+        position = next((i for i, s in enumerate(submissions) if s.identifier == cursor), None)
+        if position is None:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid pagination cursor")
+        start = position + 1
+    if limit is None:
+        return submissions[start:], None
+    page = submissions[start:start + limit]
+    next_cursor = page[-1].identifier if start + limit < len(submissions) else None
+    return page, next_cursor
+
+
+def _projection(fields: str, model) -> dict:
+    """Converts a comma separated list of fields to a mongo projection, the fields must be fields of the model"""
+    model_fields = {field.alias for field in model.__fields__.values()}
+    projection = {}
+    for field in fields.split(","):
+        field = field.strip()
+        if not field:
+            continue
+        if field.split(".")[0] not in model_fields:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Invalid field: {field}")
+        projection[field] = 1
+    return projection
+
+
+def _inject_submission_fields_raw(submission: Submission, document: dict, projection: dict) -> dict:
+    """Adds the submission fields included in the projection to a raw dataset document"""
+    if "repository_identifier" in projection and submission.repository_identifier:
+        document["repository_identifier"] = submission.repository_identifier
+    if "submission_type" in projection:
+        document["submission_type"] = submission.repository or SubmissionType.IGUIDE_FORM
+    if "s3_path" in projection and submission.s3_path:
+        document["s3_path"] = submission.s3_path.dict()
+    return document
+
+
+async def _bulk_write_datasets(dataset_writes: list) -> dict:
+    """Writes the dataset documents unordered, so that a failed write does not stop the others. Returns the status and
+    the detail of each failed write by its position in `dataset_writes`."""
+    if not dataset_writes:
+        return {}
+    try:
+        await DatasetMetadataDOC.get_motor_collection().bulk_write(dataset_writes, ordered=False)
+    except BulkWriteError as exp:
+        return {
+            error["index"]: {
+                "status": status.HTTP_409_CONFLICT if error["code"] == DUPLICATE_KEY_ERROR
+                else status.HTTP_500_INTERNAL_SERVER_ERROR,
+                "detail": error["errmsg"],
+            }
+            for error in exp.details["writeErrors"]
+        }
+    return {}
+
+
+async def _read_bulk_records(request: Request) -> list:
+    body = await request.body()
+    try:
+        if request.headers.get("content-type", "").startswith(NDJSON_MEDIA_TYPE):
+            records = [orjson.loads(line) for line in body.splitlines() if line.strip()]
+        else:
+            records = orjson.loads(body)
+    except orjson.JSONDecodeError as exp:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Invalid request body: {exp}")
+    if not isinstance(records, list):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="Request body must be an array of dataset records")
+    max_size = get_settings().dataset_bulk_max_size
+    if len(records) > max_size:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                            detail=f"A bulk request can have at most {max_size} dataset records")
+    return records
+
+
+def _validate_records(records: list, start: int) -> list:
+    """Returns a dataset document for each valid record and the status of each invalid record"""
+    results = []
+    for index, record in enumerate(records, start=start):
+        try:
+            results.append(DatasetMetadataDOC.parse_obj(record))
+        except ValidationError as exp:
+            detail = [{"loc": error["loc"], "msg": error["msg"], "type": error["type"]} for error in exp.errors()]
+            results.append({"index": index, "status": status.HTTP_422_UNPROCESSABLE_ENTITY, "detail": detail})
+    return results
+
+
+async def _validate_bulk_records(records: list) -> list:
+    """Validates chunks of the records in worker threads concurrently, keeping the event loop free for other
+    requests"""
+    chunks = [
+        run_in_threadpool(_validate_records, records[start:start + BULK_VALIDATION_CHUNK_SIZE], start)
+        for start in range(0, len(records), BULK_VALIDATION_CHUNK_SIZE)
+    ]
+    return [result for chunk in await asyncio.gather(*chunks) for result in chunk]
@@ -1,12 +1,45 @@
+import asyncio
 from datetime import datetime
+from typing import List
 
-from fastapi import APIRouter, Request, Depends
+from fastapi import APIRouter, HTTPException, Request, Depends, Query, status
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, validator
 
+from api.cache import TTLCache, get_version
 from api.config import get_settings
+from api.procedures.creators import search_creators
+from api.procedures.spatial import box_geometry
+from api.responses import BSONJSONResponse, dumps
+from api.typeahead import typeahead_index
 
 router = APIRouter()
 
+# results of discovery searches keyed by the discovery collection version and the normalized search query
+search_cache = TTLCache(maxsize=get_settings().search_cache_size, ttl=get_settings().search_cache_ttl)
+
+# value of the `cursor` parameter that starts a keyset (search-after) paginated search
+FIRST_PAGE_CURSOR = "*"
+# maximum number of buckets returned for each string facet
+FACET_NUM_BUCKETS = 50
+
+
+def _parse_coordinates(value: str, name: str, count: int) -> list:
+    """Parses comma separated longitude, latitude values. bbox is west,south,east,north, west is greater than east for
+    a box crossing the antimeridian, and near is longitude,latitude"""
+    try:
+        coordinates = [float(coordinate) for coordinate in value.split(',')]
+    except ValueError:
+        raise ValueError(f'{name} coordinate value is not a number')
+    if len(coordinates) != count:
+        raise ValueError(f'{name} must have {count} comma separated coordinate values')
+    for index, coordinate in enumerate(coordinates):
+        if index % 2 == 0 and not -180 <= coordinate <= 180:
+            raise ValueError(f'{name} longitude must be between -180 and 180')
+        if index % 2 == 1 and not -90 <= coordinate <= 90:
+            raise ValueError(f'{name} latitude must be between -90 and 90')
+    return coordinates
+
 
 class SearchQuery(BaseModel):
     term: str = None
@@ -25,8 +58,13 @@ class SearchQuery(BaseModel):
     fundingGrantName: str = None
     fundingFunderName: str = None
     creativeWorkStatus: str = None
+    bbox: str = None
+    near: str = None
+    radius: float = None
     pageNumber: int = 1
     pageSize: int = 30
+    cursor: str = None
+    withTotal: bool = False
 
     @validator('*')
     def empty_str_to_none(cls, v, field, **kwargs):
@@ -42,23 +80,56 @@ class SearchQuery(BaseModel):
         if v is None:
             return v
         try:
-            datetime(v, 1, 1)
+            # the range filters end before the first day of the year after the end year
+            datetime(v + 1, 1, 1)
         except ValueError:
             raise ValueError(f'{field.name} is not a valid year')
         if field.name == 'dataCoverageEnd':
-            if 'dataCoverageStart' in values and v < values['dataCoverageStart']:
+            if values.get('dataCoverageStart') is not None and v < values['dataCoverageStart']:
                 raise ValueError(f'{field.name} must be greater or equal to dataCoverageStart')
         if field.name == 'publishedEnd':
-            if 'publishedStart' in values and v < values['publishedStart']:
+            if values.get('publishedStart') is not None and v < values['publishedStart']:
                 raise ValueError(f'{field.name} must be greater or equal to publishedStart')
         return v
 
+    @validator('bbox')
+    def validate_bbox(cls, v, **kwargs):
+        if v is None:
+            return v
+        west, south, east, north = _parse_coordinates(v, 'bbox', 4)
+        if south > north:
+            raise ValueError('bbox south must be less or equal to north')
+        return v
+
+    @validator('near')
+    def validate_near(cls, v, **kwargs):
+        if v is None:
+            return v
+        _parse_coordinates(v, 'near', 2)
+        return v
+
+    @validator('radius')
+    def validate_radius(cls, v, values, **kwargs):
+        if v is None:
+            return v
+        if values.get('near') is None:
+            raise ValueError('radius requires near')
+        if v <= 0:
+            raise ValueError('radius must be greater than 0')
+        return v
+
     @validator('pageNumber', 'pageSize')
     def validate_page(cls, v, field, **kwargs):
         if v <= 0:
             raise ValueError(f'{field.name} must be greater than 0')
         return v
 
+    @validator('cursor')
+    def validate_cursor(cls, v, values, **kwargs):
+        if v is not None and values.get('pageNumber', 1) != 1:
+            raise ValueError('cursor can not be combined with pageNumber')
+        return v
+
     @property
     def _filters(self):
         filters = []
@@ -89,6 +160,23 @@ class SearchQuery(BaseModel):
             filters.append(
                 {'range': {'path': 'temporalCoverage.endDate', 'lt': datetime(self.dataCoverageEnd + 1, 1, 1)}}
             )
+
+        if self.bbox:
+            west, south, east, north = _parse_coordinates(self.bbox, 'bbox', 4)
+            filters.append(
+                {
+                    'geoShape': {
+                        'path': 'spatialGeometry',
+                        'relation': 'intersects',
+                        'geometry': box_geometry(west, south, east, north),
+                    }
+                }
+            )
+        if self.near:
+            longitude, latitude = _parse_coordinates(self.near, 'near', 2)
+            center = {'type': 'Point', 'coordinates': [longitude, latitude]}
+            radius = self.radius or get_settings().search_near_default_radius
+            filters.append({'geoWithin': {'path': 'spatialGeometry', 'circle': {'center': center, 'radius': radius}}})
         return filters
 
     @property
@@ -126,53 +214,292 @@ class SearchQuery(BaseModel):
         return must
 
     @property
-    def stages(self):
-        highlightPaths = ['name', 'description', 'keywords', 'keywords.name', 'creator.name']
-        stages = []
+    def _search_sort(self):
+        # sorting inside the $search stage is required for searchAfter, _id breaks ties between equal sort keys
+        if self.sortBy == "name":
+            return {'name': 1, '_id': 1}
+        if self.sortBy == "dateCreated":
+            return {'dateCreated': -1, '_id': 1}
+        return {'score': {'$meta': 'searchScore'}, '_id': 1}
+
+    @property
+    def _compound(self):
         compound = {'filter': self._filters, 'must': self._must}
         if self.term:
             compound['should'] = self._should
+        return compound
+
+    @property
+    def publication_years(self) -> range:
+        """The years of the publication year facet"""
+        # a date facet needs at least two boundaries, an open end of the range is extended to the given year
+        start_year = self.publishedStart or get_settings().search_facet_start_year
+        end_year = self.publishedEnd or datetime.utcnow().year
+        if self.publishedStart is None:
+            start_year = min(start_year, end_year)
+        if self.publishedEnd is None:
+            end_year = max(start_year, end_year)
+        return range(start_year, end_year + 1)
+
+    @property
+    def _publication_year_boundaries(self):
+        years = self.publication_years
+        return [datetime(year, 1, 1) for year in range(years.start, years.stop + 1)]
+
+    @property
+    def stages(self):
+        highlightPaths = ['name', 'description', 'keywords', 'keywords.name', 'creator.name']
+        stages = []
         search_stage = \
             {
                 '$search': {
                     'index': 'fuzzy_search',
-                    'compound': compound,
+                    'compound': self._compound,
                 }
             }
         if self.term:
             search_stage["$search"]['highlight'] = {'path': highlightPaths}
 
+        if self.cursor:
+            # keyset pagination - Atlas resumes the search after the cursor instead of skipping earlier hits
+            search_stage["$search"]['sort'] = self._search_sort
+            if self.cursor != FIRST_PAGE_CURSOR:
+                search_stage["$search"]['searchAfter'] = self.cursor
+
         stages.append(search_stage)
 
+        if not self.cursor:
             # Sort needs to happen before pagination, ignore all other values of sortBy
-        if self.sortBy == "name":
-            stages.append({'$sort': {"name": 1}})
-        if self.sortBy == "dateCreated":
-            stages.append({'$sort': {"dateCreated": -1}})
-        stages.append({'$skip': (self.pageNumber - 1) * self.pageSize})
+            if self.sortBy == "name":
+                stages.append({'$sort': {"name": 1}})
+            if self.sortBy == "dateCreated":
+                stages.append({'$sort': {"dateCreated": -1}})
+            stages.append({'$skip': (self.pageNumber - 1) * self.pageSize})
         stages.append({'$limit': self.pageSize})
         #stages.append({'$unset': ['_id', '_class_id']})
+        # the creator keys are only stored for the creators collection kept by the catalog trigger
+        stages.append({'$unset': 'creator_keys'})
         stages.append(
             {'$set': {'score': {'$meta': 'searchScore'}, 'highlights': {'$meta': 'searchHighlights'}}},
         )
-        if self.term:
+        if self.cursor:
+            # the relevance score threshold is applied by `cursor_page` so that the next cursor
+            # is taken from the last hit Atlas returned, not from the last hit above the threshold
+            stages.append({'$set': {'paginationToken': {'$meta': 'searchSequenceToken'}}})
+        elif self.term:
             # get only results which meet minimum relevance score threshold
             score_threshold = get_settings().search_relevance_score_threshold
             stages.append({'$match': {'score': {'$gt': score_threshold}}})
+
+        if self.withTotal:
+            # the total hit count is read from $$SEARCH_META within the same aggregate, $facet comes after $limit so
+            # that only the page is passed through it
+            search_stage["$search"]['count'] = {'type': 'total'}
+            meta_stages = [{'$replaceWith': '$$SEARCH_META'}, {'$limit': 1}]
+            stages.append({'$facet': {'items': [], 'meta': meta_stages}})
         return stages
 
+    @property
+    def stream_stages(self):
+        """Stages of a search over all matching records, sorted within $search and without pagination"""
+        highlightPaths = ['name', 'description', 'keywords', 'keywords.name', 'creator.name']
+        search_stage = \
+            {
+                '$search': {
+                    'index': 'fuzzy_search',
+                    'compound': self._compound,
+                    'sort': self._search_sort,
+                }
+            }
+        if self.term:
+            search_stage["$search"]['highlight'] = {'path': highlightPaths}
+        stages = [
+            search_stage,
+            {'$unset': 'creator_keys'},
+            {'$set': {'score': {'$meta': 'searchScore'}, 'highlights': {'$meta': 'searchHighlights'}}},
+        ]
+        if self.term:
+            score_threshold = get_settings().search_relevance_score_threshold
+            stages.append({'$match': {'score': {'$gt': score_threshold}}})
+        return stages
+
+    def page(self, results: list):
+        """Builds the search response from the results of `stages`"""
+        if not self.withTotal:
+            if self.cursor:
+                return self.cursor_page(results)
+            return results
 
-@router.get("/search")
+        # total is the count of all hits, it is not reduced by the relevance score threshold
+        facet = results[0]
+        if self.cursor:
+            response = self.cursor_page(facet['items'])
+        else:
+            response = {'items': facet['items']}
+        response['total'] = facet['meta'][0]['count']['total'] if facet['meta'] else 0
+        return response
+
+    @property
+    def facet_stages(self):
+        compound = self._compound
+        if self.term:
+            # only count records that match the search term
+            compound['minimumShouldMatch'] = 1
+        facets = {
+            'contentType': {'type': 'string', 'path': '@type', 'numBuckets': FACET_NUM_BUCKETS},
+            'providerName': {'type': 'string', 'path': 'provider.name', 'numBuckets': FACET_NUM_BUCKETS},
+            'submissionType': {'type': 'string', 'path': 'submission_type', 'numBuckets': FACET_NUM_BUCKETS},
+            'contentLocation': {'type': 'string', 'path': 'content_location', 'numBuckets': FACET_NUM_BUCKETS},
+            'publicationYear': {
+                'type': 'date',
+                'path': 'datePublished',
+                'boundaries': self._publication_year_boundaries,
+                'default': 'other',
+            },
+        }
+        return [
+            {
+                '$searchMeta': {
+                    'index': 'fuzzy_search',
+                    'facet': {'operator': {'compound': compound}, 'facets': facets},
+                    'count': {'type': 'total'},
+                }
+            }
+        ]
+
+    @staticmethod
+    def facet_counts(search_meta: dict) -> dict:
+        """Builds the response of a facet search from the $searchMeta result"""
+        facets = {}
+        for name, facet in search_meta['facet'].items():
+            buckets = []
+            for bucket in facet['buckets']:
+                value = bucket['_id']
+                if isinstance(value, datetime):
+                    value = value.year
+                buckets.append({'value': value, 'count': bucket['count']})
+            facets[name] = buckets
+        return {'total': search_meta['count']['total'], 'facets': facets}
+
+    def cursor_page(self, results: list) -> dict:
+        """Builds the response of a cursor paginated search from the results of `stages`"""
+        next_cursor = None
+        if len(results) == self.pageSize:
+            next_cursor = results[-1]['paginationToken']
+
+        score_threshold = get_settings().search_relevance_score_threshold
+        items = []
+        for result in results:
+            result.pop('paginationToken', None)
+            if not self.term or result['score'] > score_threshold:
+                items.append(result)
+        return {'items': items, 'nextCursor': next_cursor}
+
+    @property
+    def cache_key(self) -> str:
+        return self.json(exclude_none=True, sort_keys=True)
+
+
+@router.get("/search", response_class=BSONJSONResponse)
 async def search(request: Request, search_query: SearchQuery = Depends()):
+    """Searches the discovery collection. Pass cursor=* to page with keyset (search-after) cursors, the response
+    is then {items, nextCursor} and nextCursor is passed as the cursor of the next request. Pass withTotal=true
+    to get the response as {total, items} with the total hit count."""
+    # the catalog trigger increments the discovery version on every write to the discovery collection
+    version = await get_version(request.app.mongodb, "discovery")
+    result = await _cached_search(request.app.mongodb, search_query, version)
+    return BSONJSONResponse(result)
+
+
+@router.post("/search/batch", response_class=BSONJSONResponse)
+async def search_batch(request: Request, search_queries: List[SearchQuery]):
+    """Runs several searches concurrently and returns their results in the order of the queries"""
+    settings = get_settings()
+    if len(search_queries) > settings.search_batch_max_size:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"A batch can have at most {settings.search_batch_max_size} searches",
+        )
+
+    version = await get_version(request.app.mongodb, "discovery")
+    semaphore = asyncio.Semaphore(settings.search_batch_concurrency)
+
+    async def run_search(search_query: SearchQuery) -> bytes:
+        async with semaphore:
+            return await _cached_search(request.app.mongodb, search_query, version)
+
+    results = await asyncio.gather(*(run_search(search_query) for search_query in search_queries))
+    return BSONJSONResponse(b"[" + b",".join(results) + b"]")
+
+
+@router.get("/facets", response_class=BSONJSONResponse)
+async def facets(request: Request, search_query: SearchQuery = Depends()):
+    """Counts the records matching the search filters per content type, provider, submission type, content location
+    and publication year with a single $searchMeta stage"""
+    max_years = get_settings().search_facet_max_years
+    if len(search_query.publication_years) > max_years:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f"The publication year facet can count at most {max_years} years, narrow the publishedStart to "
+                   f"publishedEnd range",
+        )
+    cache_key = (await get_version(request.app.mongodb, "discovery"), "facets", search_query.cache_key)
+    result = search_cache.get(cache_key)
+    if result is None:
+        search_meta = await request.app.mongodb["discovery"].aggregate(search_query.facet_stages).to_list(1)
+        result = dumps(search_query.facet_counts(search_meta[0]))
+        search_cache.set(cache_key, result)
+    return BSONJSONResponse(result)
+
+
+@router.get("/search/stream")
+async def search_stream(
+    request: Request, search_query: SearchQuery = Depends(), batchSize: int = Query(default=None, gt=0, le=1000)
+):
+    """Streams every record matching the search as newline delimited JSON. Records are read from the database and
+    written to the response one batch at a time, pageNumber, pageSize, cursor and withTotal are ignored."""
+    batch_size = batchSize or get_settings().search_stream_batch_size
+    cursor = request.app.mongodb["discovery"].aggregate(search_query.stream_stages, batchSize=batch_size)
+
+    async def ndjson_lines():
+        try:
+            while True:
+                batch = await cursor.to_list(batch_size)
+                if not batch or await request.is_disconnected():
+                    break
+                yield b"".join(dumps(document) + b"\n" for document in batch)
+        finally:
+            await cursor.close()
+
+    return StreamingResponse(ndjson_lines(), media_type="application/x-ndjson")
+
+
+@router.get("/search/cache")
+async def search_cache_stats():
+    return search_cache.stats()
+
+
+async def _cached_search(db, search_query: SearchQuery, version: int) -> bytes:
+    cache_key = (version, search_query.cache_key)
+    result = search_cache.get(cache_key)
+    if result is None:
+        result = await _search(db, search_query)
+        search_cache.set(cache_key, result)
+    return result
+
+
+async def _search(db, search_query: SearchQuery) -> bytes:
     stages = search_query.stages
-    result = await request.app.mongodb["discovery"].aggregate(stages).to_list(search_query.pageSize)
-    import json
-    json_str = json.dumps(result, default=str)
-    return json.loads(json_str)
+    result = await db["discovery"].aggregate(stages).to_list(search_query.pageSize)
+    return dumps(search_query.page(result))
 
 
 @router.get("/typeahead")
 async def typeahead(request: Request, term: str, pageSize: int = 30):
+    if typeahead_index.ready:
+        return typeahead_index.search(term, pageSize)
+
+    # the in-memory index is still loading
     search_paths = ['name', 'description', 'keywords', 'keywords.name']
     should = [{'autocomplete': {'query': term, 'path': key, 'fuzzy': {'maxEdits': 1}}} for key in search_paths]
 
@@ -200,26 +527,6 @@ async def typeahead(request: Request, term: str, pageSize: int = 30):
 
 @router.get("/creators")
 async def creator_search(request: Request, name: str, pageSize: int = 30) -> list[str]:
-    stages = [
-        {
-            '$search': {
-                'index': 'fuzzy_search',
-                'autocomplete': {"query": name, "path": "creator.name", 'fuzzy': {'maxEdits': 1}},
-                'highlight': {'path': 'creator.name'},
-            }
-        },
-        {'$project': {"_id": 0, "creator.name": 1, "highlights": {'$meta': 'searchHighlights'}}},
-    ]
-
-    results = await request.app.mongodb["discovery"].aggregate(stages).to_list(pageSize)
-
-    names = []
-    for result in results:
-        for highlight in result['highlights']:
-            for text in highlight['texts']:
-                if text['type'] == 'hit':
-                    for creator in result['creator']:
-                        if text['value'] in creator['name']:
-                            names.append(creator['name'])
-
-    return set(names)
\ No newline at end of file
+    """Returns the names of the creators matching `name`, the creators credited by the most records first. Creators
+    are counted by the catalog trigger, one entry per ORCID or normalized name."""
+    return await search_creators(request.app.mongodb, name, pageSize)
@@ -0,0 +1,147 @@
+import asyncio
+import logging
+import re
+import sys
+from bisect import bisect_left, insort
+from typing import Dict, List, Tuple
+
+logger = logging.getLogger()
+
+# words of this length or shorter are not useful as hints and are not indexed
+MIN_WORD_LENGTH = 3
+# upper bound on the number of terms examined for a single prefix lookup
+MAX_PREFIX_MATCHES = 1000
+
+
+def normalize(text: str) -> str:
+    """Normalizes text the way the typeahead trigger sanitizes it, lower cased"""
+    text = re.sub(r'[^a-z0-9,\-_ ]', '', text.lower())
+    return " ".join(text.split())
+
+
+class TypeaheadIndex:
+    """In-memory prefix index of the terms in the typeahead collection.
+
+    Terms are the words of the record names and descriptions and the record keywords. Term keys are held in a sorted
+    list so that all terms with a given prefix are found with a binary search. The index is loaded from the typeahead
+    collection and then kept up to date from its change stream by `watch`.
+    """
+
+    def __init__(self):
+        self.ready = False
+        # sorted normalized term keys
+        self._terms: List[str] = []
+        # term key -> number of records containing the term
+        self._counts: Dict[str, int] = {}
+        # term key -> (term as it is shown in hints, path of the field the term was found in)
+        self._values: Dict[str, Tuple[str, str]] = {}
+        # record id -> term keys of the record
+        self._records: Dict[object, Tuple[str, ...]] = {}
+
+    def __len__(self):
+        return len(self._terms)
+
+    @staticmethod
+    def _record_terms(document: dict) -> Dict[str, Tuple[str, str]]:
+        terms = {}
+        for path in ('name', 'description'):
+            for word in (document.get(path) or '').split():
+                word = word.strip(',-_')
+                key = normalize(word)
+                if len(key) > MIN_WORD_LENGTH and key not in terms:
+                    terms[key] = (word, path)
+        for keyword in document.get('keywords') or []:
+            if isinstance(keyword, dict):
+                keyword = keyword.get('name') or ''
+            key = normalize(keyword)
+            if len(key) > MIN_WORD_LENGTH:
+                terms[key] = (keyword, 'keywords')
+        # records share a single copy of each term key
+        return {sys.intern(key): value for key, value in terms.items()}
+
+    def add(self, document: dict) -> None:
+        for key in self._add(document):
+            insort(self._terms, key)
+
+    def _add(self, document: dict) -> List[str]:
+        """Adds the record terms to the term counts and returns the keys of the terms new to the index"""
+        self.remove(document['_id'])
+        terms = self._record_terms(document)
+        new_keys = []
+        for key, value in terms.items():
+            count = self._counts.get(key, 0)
+            if count == 0:
+                new_keys.append(key)
+                self._values[key] = value
+            self._counts[key] = count + 1
+        self._records[document['_id']] = tuple(terms)
+        return new_keys
+
+    def remove(self, record_id) -> None:
+        for key in self._records.pop(record_id, ()):
+            count = self._counts[key] - 1
+            if count == 0:
+                del self._counts[key]
+                del self._values[key]
+                del self._terms[bisect_left(self._terms, key)]
+            else:
+                self._counts[key] = count
+
+    def search(self, term: str, limit: int) -> List[dict]:
+        """Returns the most common terms starting with `term` as typeahead hints, shaped like Atlas search
+        highlights"""
+        prefix = normalize(term)
+        if not prefix:
+            return []
+        matches = []
+        index = bisect_left(self._terms, prefix)
+        while index < len(self._terms) and len(matches) < MAX_PREFIX_MATCHES:
+            key = self._terms[index]
+            if not key.startswith(prefix):
+                break
+            matches.append(key)
+            index += 1
+        matches.sort(key=lambda key: self._counts[key], reverse=True)
+
+        hints = []
+        for key in matches[:limit]:
+            value, path = self._values[key]
+            texts = [{'value': value, 'type': 'hit'}]
+            hints.append({'highlights': [{'path': path, 'score': self._counts[key], 'texts': texts}]})
+        return hints
+
+    def clear(self) -> None:
+        self.ready = False
+        self._terms.clear()
+        self._counts.clear()
+        self._values.clear()
+        self._records.clear()
+
+    async def load(self, collection) -> None:
+        self.clear()
+        async for document in collection.find({}, {'name': 1, 'description': 1, 'keywords': 1}):
+            self._terms.extend(self._add(document))
+        # sorting once is much faster than inserting every term in order
+        self._terms.sort()
+        self.ready = True
+
+    async def watch(self, collection) -> None:
+        """Loads the index and applies every change of the typeahead collection to it, restarting on errors"""
+        while True:
+            try:
+                async with collection.watch(full_document="updateLookup") as stream:
+                    # loading after the stream is opened ensures no change is missed, replayed changes are harmless
+                    await self.load(collection)
+                    async for change in stream:
+                        if change["operationType"] == "delete":
+                            self.remove(change["documentKey"]["_id"])
+                        elif change.get("fullDocument"):
+                            self.add(change["fullDocument"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as exp:
+                logger.exception(f"Typeahead Watch Task failed.\n Error:{str(exp)}\n Restarting the task")
+                await asyncio.sleep(5)
+
+
+typeahead_index = TypeaheadIndex()
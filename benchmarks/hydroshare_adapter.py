@@ -0,0 +1,106 @@
+"""Compares fetching HydroShare resource metadata with blocking `requests` calls, as the adapter used to, and with the
+shared async client of the repository request handlers, against a local mock HydroShare server that answers after a
+fixed latency.
+
+Run from the repository root:
+    PYTHONPATH=. python benchmarks/hydroshare_adapter.py
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+# (number of concurrent registrations, number of file list pages of each resource)
+SCENARIOS = [(50, 3), (1, 30)]
+LATENCY = 0.05
+
+
+class _MockHydroShare(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    connections = 0
+    file_pages = 1
+
+    def setup(self):
+        super().setup()
+        _MockHydroShare.connections += 1
+
+    def do_GET(self):
+        time.sleep(LATENCY)
+        host = f"http://{self.headers['Host']}"
+        if "/files/" in self.path:
+            page = int(self.path.rsplit("page=", 1)[-1]) if "page=" in self.path else 1
+            path = self.path.split("?")[0]
+            next_url = f"{host}{path}?page={page + 1}" if page < self.file_pages else None
+            results = [{"file_name": f"{page}-{i}"} for i in range(100)]
+            body = {"count": self.file_pages * 100, "next": next_url, "results": results}
+        else:
+            body = {"title": "Mock resource", "abstract": "Mock resource abstract"}
+        content = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _blocking_get_metadata(meta_url: str, file_url: str) -> dict:
+    """The previous implementation of the HydroShare request handler"""
+    metadata = requests.get(meta_url).json()
+    response = requests.get(file_url)
+    content_files = list(response.json()["results"])
+    while response.json()["next"]:
+        response = requests.get(response.json()["next"])
+        content_files.extend(response.json()["results"])
+    metadata["content_files"] = content_files
+    return metadata
+
+
+async def _blocking(resources: int, meta_url: str, file_url: str) -> None:
+    async def register(record_id):
+        # the blocking call holds the event loop, so the registrations run one after another
+        _blocking_get_metadata(meta_url % record_id, file_url % record_id)
+
+    await asyncio.gather(*[register(record_id) for record_id in range(resources)])
+
+
+async def _pooled(resources: int) -> None:
+    from api.adapters.base import http_client_pool
+    from api.adapters.hydroshare import HydroshareMetadataAdapter
+
+    adapter = HydroshareMetadataAdapter()
+    await asyncio.gather(*[adapter.get_metadata(str(record_id)) for record_id in range(resources)])
+    await http_client_pool.close()
+
+
+def main():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _MockHydroShare)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host = f"http://127.0.0.1:{server.server_port}"
+    meta_url = f"{host}/hsapi2/resource/%s/json/"
+    file_url = f"{host}/hsapi/resource/%s/files/"
+    os.environ["HYDROSHARE_META_READ_URL"] = meta_url
+    os.environ["HYDROSHARE_FILE_READ_URL"] = file_url
+
+    for resources, file_pages in SCENARIOS:
+        _MockHydroShare.file_pages = file_pages
+        print(f"{resources} concurrent registrations, {file_pages} file pages each, {LATENCY * 1000:.0f} ms latency")
+        runs = [("blocking requests", lambda: _blocking(resources, meta_url, file_url)),
+                ("pooled async client", lambda: _pooled(resources))]
+        for name, run in runs:
+            _MockHydroShare.connections = 0
+            start = time.perf_counter()
+            asyncio.run(run())
+            elapsed = time.perf_counter() - start
+            print(f"{name:>20}: {elapsed:6.2f} s, {_MockHydroShare.connections} connections opened")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
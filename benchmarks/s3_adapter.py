@@ -0,0 +1,92 @@
+"""Compares fetching S3 metadata files with a new boto3 client per fetch run on the event loop, as the adapter used to,
+and with the pooled clients run in the S3 thread pool, against a local moto S3 server. Also reports the longest time
+the event loop was held up while the fetches ran.
+
+Run from the repository root:
+    PYTHONPATH=. python benchmarks/s3_adapter.py
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+
+import boto3
+from botocore import UNSIGNED
+from botocore.client import Config
+from moto.server import ThreadedMotoServer
+
+FILES = 200
+BUCKET = "benchmark"
+
+
+def _blocking_get_metadata(endpoint_url: str, key: str) -> dict:
+    """The previous implementation of the S3 request handler"""
+    s3 = boto3.client('s3', config=Config(signature_version=UNSIGNED), endpoint_url=endpoint_url)
+    response = s3.get_object(Bucket=BUCKET, Key=key)
+    return json.loads(response['Body'].read().decode('utf-8'))
+
+
+async def _blocking(endpoint_url: str) -> None:
+    async def register(key):
+        _blocking_get_metadata(endpoint_url, key)
+
+    await asyncio.gather(*[register(f"metadata/{i}.json") for i in range(FILES)])
+
+
+async def _pooled(endpoint_url: str) -> None:
+    from api.adapters.s3 import S3MetadataAdapter
+
+    adapter = S3MetadataAdapter()
+    await asyncio.gather(*[adapter.get_metadata(f"{endpoint_url}+{BUCKET}+metadata/{i}.json") for i in range(FILES)])
+
+
+async def _measure(run) -> tuple:
+    """Returns the run time and the longest gap between ticks of a 1 ms heartbeat running alongside"""
+    max_gap = 0.0
+    running = True
+
+    async def heartbeat():
+        nonlocal max_gap
+        last = time.perf_counter()
+        while running:
+            await asyncio.sleep(0.001)
+            now = time.perf_counter()
+            max_gap = max(max_gap, now - last)
+            last = now
+
+    beat = asyncio.create_task(heartbeat())
+    start = time.perf_counter()
+    await run()
+    elapsed = time.perf_counter() - start
+    running = False
+    await beat
+    return elapsed, max_gap
+
+
+def main():
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "benchmark")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "benchmark")
+    server = ThreadedMotoServer(ip_address="127.0.0.1", port=0, verbose=False)
+    server.start()
+    host, port = server.get_host_and_port()
+    endpoint_url = f"http://{host}:{port}"
+
+    s3 = boto3.client("s3", endpoint_url=endpoint_url, region_name="us-east-1")
+    s3.create_bucket(Bucket=BUCKET)
+    with open("tests/data/dataset_metadata.json") as f:
+        metadata = f.read()
+    # the adapter reads anonymously
+    for i in range(FILES):
+        s3.put_object(Bucket=BUCKET, Key=f"metadata/{i}.json", Body=metadata, ACL="public-read")
+
+    print(f"{FILES} concurrent S3 registrations")
+    for name, run in [("client per fetch", _blocking), ("pooled clients", _pooled)]:
+        elapsed, max_gap = asyncio.run(_measure(lambda: run(endpoint_url)))
+        print(f"{name:>17}: {elapsed:6.2f} s, event loop held up to {max_gap * 1000:7.1f} ms")
+    server.stop()
+
+
+if __name__ == "__main__":
+    main()
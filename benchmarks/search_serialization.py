@@ -0,0 +1,64 @@
+"""Compares the serialization cost of a discovery search page before and after the BSON aware response.
+
+Run from the repository root:
+    PYTHONPATH=. python benchmarks/search_serialization.py
+"""
+import json
+import os
+import timeit
+from datetime import datetime
+
+from bson import ObjectId
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from api.responses import BSONJSONResponse
+
+PAGE_SIZE = 30
+ITERATIONS = 2000
+
+
+def search_page():
+    data_file = os.path.join(os.path.dirname(__file__), "..", "tests", "data", "dataset_metadata.json")
+    with open(data_file, "r") as f:
+        document = json.loads(f.read())
+
+    page = []
+    for index in range(PAGE_SIZE):
+        result = dict(document)
+        result["_id"] = ObjectId()
+        result["dateCreated"] = datetime(2021, 1, 1)
+        result["datePublished"] = datetime(2023, 5, 10)
+        result["registrationDate"] = datetime.utcnow()
+        result["score"] = 2.5 + index
+        result["highlights"] = [
+            {
+                "path": path,
+                "score": 1.2,
+                "texts": [{"value": "This is a ", "type": "text"}, {"value": "test", "type": "hit"}],
+            }
+            for path in ["name", "description", "keywords", "keywords.name", "creator.name"]
+        ]
+        page.append(result)
+    return page
+
+
+def json_round_trip(page):
+    # the search endpoint before: dumps, loads and then serialized again by FastAPI
+    content = json.loads(json.dumps(page, default=str))
+    return JSONResponse(jsonable_encoder(content)).body
+
+
+def bson_json_response(page):
+    return BSONJSONResponse(page).body
+
+
+def main():
+    page = search_page()
+    for func in (json_round_trip, bson_json_response):
+        seconds = timeit.timeit(lambda: func(page), number=ITERATIONS)
+        print(f"{func.__name__:<20} {seconds / ITERATIONS * 1e6:10.1f} us per page of {PAGE_SIZE}")
+
+
+if __name__ == "__main__":
+    main()
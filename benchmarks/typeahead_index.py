@@ -0,0 +1,62 @@
+"""Reports the memory footprint and lookup latency of the in-memory typeahead index for 100k records.
+
+Run from the repository root:
+    PYTHONPATH=. python benchmarks/typeahead_index.py
+"""
+import asyncio
+import itertools
+import random
+import string
+import timeit
+import tracemalloc
+
+from api.typeahead import TypeaheadIndex
+
+RECORDS = 100_000
+VOCABULARY = 50_000
+LOOKUPS = 10_000
+
+
+class _TypeaheadCollection:
+    """Stand-in for the typeahead collection that generates records as they are read"""
+
+    def __init__(self, records: int):
+        rng = random.Random(42)
+        self.words = ["".join(rng.choices(string.ascii_lowercase, k=rng.randint(4, 12))) for _ in range(VOCABULARY)]
+        # word frequencies follow a zipf like distribution
+        self.cum_weights = list(itertools.accumulate(1 / rank for rank in range(1, VOCABULARY + 1)))
+        self.records = records
+        self.rng = rng
+
+    def _text(self, words: int) -> str:
+        return " ".join(self.rng.choices(self.words, cum_weights=self.cum_weights, k=words))
+
+    def find(self, *args):
+        return self._records()
+
+    async def _records(self):
+        for record_id in range(self.records):
+            yield {
+                "_id": record_id,
+                "name": self._text(6),
+                "description": self._text(60),
+                "keywords": [self._text(2) for _ in range(4)],
+            }
+
+
+def main():
+    collection = _TypeaheadCollection(RECORDS)
+    index = TypeaheadIndex()
+    tracemalloc.start()
+    asyncio.run(index.load(collection))
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"records: {RECORDS}, terms: {len(index)}, memory: {size / 2 ** 20:.1f} MiB")
+
+    prefixes = [word[:4] for word in random.Random(7).choices(collection.words, k=LOOKUPS)]
+    seconds = timeit.timeit(lambda: [index.search(prefix, 30) for prefix in prefixes], number=1)
+    print(f"lookup: {seconds / LOOKUPS * 1e6:.1f} us per prefix")
+
+
+if __name__ == "__main__":
+    main()
@@ -25,22 +25,24 @@ export default class Search extends Model {
   }
 
   /** Performs a search and stores the result in state.results.
-   * @returns a boolean indicating if the query has more pages that can be fetched with `fetchMore` method
+   * @returns a boolean indicating if the query has more pages that can be fetched with `fetchMore` method,
+   * based on the total hit count returned with the first page
    */
   public static async search(params: ISearchParams) {
     const response: Response = await fetch(
-      `${ENDPOINTS.search}?${getQueryString(params)}`,
+      `${ENDPOINTS.search}?${getQueryString({ ...params, withTotal: true })}`,
     );
 
     if (!response.ok) {
       throw new Error("Network response was not OK");
     }
 
-    const rawResults: any[] = await response.json();
+    const { total, items }: { total: number; items: any[] } =
+      await response.json();
     this.commit((state) => {
-      state.results = rawResults.map(this._parseResult);
+      state.results = items.map(this._parseResult);
     });
-    return rawResults.length === params.pageSize;
+    return params.pageNumber * params.pageSize < total;
   }
 
   /** Fetches the next page indicated by params.pageNumber and appends the incoming items to `state.results`
@@ -48,21 +50,21 @@ export default class Search extends Model {
    */
   public static async fetchMore(params: ISearchParams): Promise<boolean> {
     const response: Response = await fetch(
-      `${ENDPOINTS.search}?${getQueryString(params)}`,
+      `${ENDPOINTS.search}?${getQueryString({ ...params, withTotal: true })}`,
     );
 
     if (!response.ok) {
       throw new Error("Network response was not OK");
     }
 
-    const incoming = await response.json();
+    const { total, items }: { total: number; items: any[] } =
+      await response.json();
 
     this.commit((state) => {
-      state.results =
-        [...state.results, ...incoming.map(this._parseResult)] || [];
+      state.results = [...state.results, ...items.map(this._parseResult)] || [];
     });
 
-    return incoming.length === params.pageSize;
+    return params.pageNumber * params.pageSize < total;
   }
 
   /** Performs a typeahead search and returns the results */
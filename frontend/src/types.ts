@@ -68,6 +68,7 @@ export interface ISearchParams {
   providerName?: string;
   // clusters?: string[];
   sortBy?: "name" | "dateCreated" | "relevance";
+  withTotal?: boolean;
 }
 
 export interface ITypeaheadParams {
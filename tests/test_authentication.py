@@ -0,0 +1,267 @@
+import asyncio
+import gc
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+import rsa
+from fastapi import HTTPException
+from beanie import PydanticObjectId
+from jose import jwk, jwt
+from starlette.requests import Request
+
+from api.authentication import fastapi_resource_server
+from api.authentication.fastapi_resource_server import JwksCache, JwtDecodeOptions, OidcResourceServer
+from api.authentication import user as authentication_user
+from api.authentication.user import auth_scheme, get_current_user
+from api.main import readiness_check
+from api.models.user import User
+
+
+class StandInIssuer(BaseHTTPRequestHandler):
+    """Serves the discovery document and the JWKS of a local OIDC issuer"""
+
+    issuer = None
+    jwks = {"keys": []}
+    jwks_requests = 0
+
+    def do_GET(self):
+        if self.path.endswith("/.well-known/openid-configuration"):
+            body = {
+                "issuer": self.issuer,
+                "authorization_endpoint": f"{self.issuer}/auth",
+                "token_endpoint": f"{self.issuer}/token",
+                "jwks_uri": f"{self.issuer}/certs",
+                "grant_types_supported": ["implicit"],
+            }
+        elif self.path.endswith("/certs"):
+            StandInIssuer.jwks_requests += 1
+            body = StandInIssuer.jwks
+        else:
+            self.send_error(404)
+            return
+        content = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def signing_key(kid: str) -> dict:
+    public_key, private_key = rsa.newkeys(1024)
+    public_jwk = jwk.construct(public_key.save_pkcs1().decode(), "RS256").to_dict()
+    return {"kid": kid, "private": private_key.save_pkcs1().decode(), "public": {**public_jwk, "kid": kid}}
+
+
+@pytest.fixture(scope="module")
+def issuer():
+    server = HTTPServer(("127.0.0.1", 0), StandInIssuer)
+    StandInIssuer.issuer = f"http://127.0.0.1:{server.server_port}/realms/test"
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield StandInIssuer
+    server.shutdown()
+
+
+def issue_token(key: dict, issuer: str, **claims) -> str:
+    claims = {"iss": issuer, "sub": "user", "preferred_username": "0000-0002-1825-0097",
+              "exp": int(time.time()) + 300, **claims}
+    return jwt.encode(claims, key["private"], algorithm="RS256", headers={"kid": key["kid"]})
+
+
+def bearer_request(access_token: str) -> Request:
+    headers = [(b"authorization", f"Bearer {access_token}".encode())]
+    return Request({"type": "http", "method": "GET", "path": "/", "headers": headers})
+
+
+@pytest.mark.asyncio
+async def test_claims_cache_and_orcid_lookup_dedup(monkeypatch):
+    """Test that concurrent requests with a new token share one ORCID lookup and later requests use no lookups"""
+
+    calls = {"get_user": 0, "fetch_orcid": 0}
+
+    async def get_user(access_token):
+        calls["get_user"] += 1
+        return None
+
+    async def fetch_orcid(access_token):
+        calls["fetch_orcid"] += 1
+        await asyncio.sleep(0.01)
+        return "0000-0002-1825-0097"
+
+    monkeypatch.setattr(fastapi_resource_server, "get_user", get_user)
+    monkeypatch.setattr(fastapi_resource_server, "fetch_orcid", fetch_orcid)
+    auth_scheme.claims_cache.clear()
+
+    claims = await asyncio.gather(*[auth_scheme(bearer_request("new-token")) for _ in range(5)])
+    assert all(claim == {"orcid": "0000-0002-1825-0097", "access_token": "new-token"} for claim in claims)
+    assert calls["fetch_orcid"] == 1
+
+    calls["get_user"] = 0
+    assert (await auth_scheme(bearer_request("new-token")))["orcid"] == "0000-0002-1825-0097"
+    assert calls == {"get_user": 0, "fetch_orcid": 1}
+    auth_scheme.claims_cache.clear()
+
+
+@pytest.mark.asyncio
+async def test_verify_tokens_locally(issuer):
+    """Test that tokens are verified against the cached JWKS without calling the issuer"""
+
+    key = signing_key("first")
+    issuer.jwks = {"keys": [key["public"]]}
+    server = OidcResourceServer(issuer.issuer, verify_tokens=True, allowed_grant_types=["implicit"],
+                                jwt_decode_options=JwtDecodeOptions(verify_aud=False))
+    await server.discover()
+    jwks_requests = issuer.jwks_requests
+
+    token = issue_token(key, issuer.issuer)
+    claims = await server(bearer_request(token))
+    assert claims["orcid"] == "0000-0002-1825-0097"
+    assert claims["access_token"] == token
+    assert issuer.jwks_requests == jwks_requests
+
+    for invalid_token in [token[:-4] + "AAAA", issue_token(key, issuer.issuer, exp=int(time.time()) - 60),
+                          issue_token(key, "https://another.issuer")]:
+        with pytest.raises(HTTPException):
+            await server(bearer_request(invalid_token))
+
+
+@pytest.mark.asyncio
+async def test_verify_tokens_key_rotation(issuer):
+    """Test that the JWKS is fetched again when a token is signed with an unknown key id"""
+
+    first_key, second_key = signing_key("first"), signing_key("second")
+    issuer.jwks = {"keys": [first_key["public"]]}
+    server = OidcResourceServer(issuer.issuer, verify_tokens=True, allowed_grant_types=["implicit"],
+                                jwks_min_refresh_interval=0)
+    await server.discover()
+
+    issuer.jwks = {"keys": [second_key["public"]]}
+    jwks_requests = issuer.jwks_requests
+    tokens = [issue_token(second_key, issuer.issuer) for _ in range(3)]
+    claims = await asyncio.gather(*[server(bearer_request(token)) for token in tokens])
+    assert [claim["access_token"] for claim in claims] == tokens
+    # concurrent requests with the new key share one refresh
+    assert issuer.jwks_requests == jwks_requests + 1
+
+    with pytest.raises(HTTPException):
+        await server(bearer_request(issue_token(signing_key("unknown"), issuer.issuer)))
+
+
+@pytest.mark.asyncio
+async def test_jwks_background_refresh_failure():
+    """Test that a failed background JWKS refresh keeps the current keys and its exception is retrieved"""
+
+    key = signing_key("first")
+    cache = JwksCache("http://127.0.0.1:1/realms/test/certs", refresh_interval=0)
+    cache.load({"keys": [key["public"]]})
+    errors = []
+    loop = asyncio.get_running_loop()
+    loop.set_exception_handler(lambda loop, context: errors.append(context))
+    try:
+        assert await cache.get_key("first") is not None
+        refresh = cache._refresh
+        await asyncio.wait([refresh])
+        # an exception that was never retrieved is reported when the task is collected
+        cache._refresh = refresh = None
+        gc.collect()
+        assert errors == []
+        assert "first" in cache._keys
+    finally:
+        loop.set_exception_handler(None)
+
+
+@pytest.mark.asyncio
+async def test_lazy_discovery_with_snapshot_fallback(issuer, tmp_path):
+    """Test that the discovery documents are loaded on first use and from the snapshot when the issuer is down"""
+
+    key = signing_key("first")
+    issuer.jwks = {"keys": [key["public"]]}
+    snapshot_path = str(tmp_path / "oidc_discovery.json")
+    server = OidcResourceServer(issuer.issuer, verify_tokens=True, allowed_grant_types=["implicit"],
+                                snapshot_path=snapshot_path)
+    assert not server.ready
+    assert server.model.flows.implicit is None
+
+    token = issue_token(key, issuer.issuer)
+    claims = await server(bearer_request(token))
+    assert claims["access_token"] == token
+    assert server.ready
+    assert server.model.flows.implicit.authorizationUrl == f"{issuer.issuer}/auth"
+
+    # an issuer that can not be reached
+    down_issuer = "http://127.0.0.1:1/realms/test"
+    server = OidcResourceServer(down_issuer, verify_tokens=True, snapshot_path=snapshot_path)
+    claims = await server(bearer_request(token))
+    assert claims["access_token"] == token
+
+    server = OidcResourceServer(down_issuer, verify_tokens=True, snapshot_path=str(tmp_path / "missing.json"))
+    with pytest.raises(HTTPException) as exc_info:
+        await server(bearer_request(token))
+    assert exc_info.value.status_code == 503
+    assert not server.ready
+
+
+@pytest.mark.asyncio
+async def test_readiness_check(monkeypatch):
+    """Test that the API waits for the discovery documents only when the access tokens are verified"""
+
+    discoveries = []
+    monkeypatch.setattr(auth_scheme, "well_known", None)
+    monkeypatch.setattr(auth_scheme, "start_discovery", lambda: discoveries.append(True))
+
+    monkeypatch.setattr(auth_scheme, "verify_tokens", True)
+    response = await readiness_check()
+    assert response.status_code == 503
+    assert len(discoveries) == 1
+
+    monkeypatch.setattr(auth_scheme, "verify_tokens", False)
+    response = await readiness_check()
+    assert response.status_code == 200
+    # the discovery documents are still loaded for the OpenAPI security scheme
+    assert len(discoveries) == 2
+
+
+@pytest.mark.asyncio
+async def test_current_user_version(monkeypatch):
+    """Test that a cached user is used while its version is current and read again once the submissions of the user
+    were written by another process"""
+
+    user_id = PydanticObjectId()
+    stored = {"submissions": [], "version": 0}
+    calls = {"create_or_update_user": 0}
+
+    async def create_or_update_user(orcid, access_token):
+        calls["create_or_update_user"] += 1
+        return User.construct(id=user_id, orcid=orcid, access_token=access_token,
+                              submissions=list(stored["submissions"]), version=stored["version"])
+
+    async def user_version(document_id):
+        assert document_id == user_id
+        return stored["version"]
+
+    monkeypatch.setattr(authentication_user, "create_or_update_user", create_or_update_user)
+    monkeypatch.setattr(authentication_user, "user_version", user_version)
+    authentication_user.user_cache.clear()
+
+    claims = {"orcid": "0000-0002-1825-0097", "access_token": "token"}
+    first = await get_current_user(claims)
+    assert first.id == user_id
+    assert await get_current_user(claims) is first
+    assert calls["create_or_update_user"] == 1
+
+    # a submission added by a background job or another API instance
+    stored["submissions"].append("submission")
+    stored["version"] += 1
+    second = await get_current_user(claims)
+    assert second is not first
+    assert second.submissions == ["submission"]
+    assert await get_current_user(claims) is second
+    assert calls["create_or_update_user"] == 2
+    authentication_user.user_cache.clear()
@@ -0,0 +1,34 @@
+import pytest
+
+from api.cache import TTLCache
+
+
+@pytest.mark.asyncio
+async def test_ttl_cache_lru_eviction():
+    """Test that the least recently used entry is evicted once the cache is full"""
+
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert len(cache) == 2
+    assert cache.stats()["hits"] == 3
+    assert cache.stats()["misses"] == 1
+
+
+@pytest.mark.asyncio
+async def test_ttl_cache_expiry(monkeypatch):
+    """Test that entries are not returned after their ttl has passed"""
+
+    now = 1000.0
+    monkeypatch.setattr("api.cache.time.monotonic", lambda: now)
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    assert cache.get("a") == 1
+    now += 61
+    assert cache.get("a") is None
+    assert len(cache) == 0
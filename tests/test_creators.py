@@ -0,0 +1,121 @@
+import pytest
+
+from api.procedures.creators import (
+    CREATORS_COLLECTION,
+    CREATORS_PREFIX_INDEX,
+    creator_entries,
+    name_prefixes,
+    name_tokens,
+    search_creators,
+    update_creators,
+)
+
+
+class StandInCollection:
+    """Runs the queries of the creators procedures over a dict of documents by id"""
+
+    def __init__(self, documents=()):
+        self.documents = {document["_id"]: document for document in documents}
+
+    async def delete_one(self, query):
+        document = self.documents.get(query["_id"])
+        if document is not None and document["count"] <= query["count"]["$lte"]:
+            del self.documents[query["_id"]]
+
+    async def update_one(self, query, update, upsert=False):
+        if query["_id"] not in self.documents:
+            if not upsert:
+                return
+            self.documents[query["_id"]] = {"_id": query["_id"]}
+        document = self.documents[query["_id"]]
+        document.update(update.get("$set", {}))
+        for field, increment in update.get("$inc", {}).items():
+            document[field] = document.get(field, 0) + increment
+
+    def find(self, query, projection):
+        prefixes = query["prefixes"]["$all"]
+        documents = [
+            document for document in self.documents.values()
+            if all(prefix in document["prefixes"] for prefix in prefixes)
+        ]
+
+        class Cursor:
+            def sort(self, field, direction):
+                documents.sort(key=lambda document: document[field] * direction)
+                return self
+
+            def hint(self, index):
+                assert index == CREATORS_PREFIX_INDEX
+                return self
+
+            def limit(self, length):
+                return self
+
+            async def to_list(self, length):
+                return [{"_id": document["_id"], "name": document["name"]} for document in documents[:length]]
+
+        return Cursor()
+
+
+@pytest.mark.asyncio
+async def test_creator_entries(dataset_data):
+    """Test that creators are keyed by ORCID when available and by normalized name otherwise"""
+
+    dataset_data["creator"] = [
+        {"@type": "Person", "name": "John Doe", "identifier": "https://orcid.org/0000-0000-0000-0001"},
+        {"@type": "Person", "name": "Doe,  Jane"},
+        {"@type": "Person", "name": "doe, jane"},
+        {"@type": "Organization", "name": "Utah State University"},
+    ]
+    entries = creator_entries(dataset_data)
+    assert list(entries) == ["orcid:0000-0000-0000-0001", "name:doe jane", "name:utah state university"]
+    assert entries["orcid:0000-0000-0000-0001"] == {"name": "John Doe", "tokens": ["john", "doe"]}
+    assert entries["name:doe jane"]["name"] == "doe, jane"
+
+
+@pytest.mark.asyncio
+async def test_update_creators():
+    """Test that the creators are counted from the creator keys of a record before and after a write, renamed while
+    credited and removed once no record credits them"""
+
+    creators = StandInCollection()
+    db = {CREATORS_COLLECTION: creators}
+    john = {"name": "John Doe", "tokens": ["john", "doe"]}
+    jane = {"name": "Doe, Jane", "tokens": ["doe", "jane"]}
+
+    # two records are created
+    await update_creators(db, [], {"orcid:1": john, "name:doe jane": jane})
+    await update_creators(db, [], {"orcid:1": john})
+    assert creators.documents["orcid:1"]["count"] == 2
+    assert creators.documents["orcid:1"]["prefixes"] == name_prefixes(["john", "doe"])
+    assert creators.documents["name:doe jane"]["count"] == 1
+
+    # the second record is updated with a new name of the creator
+    await update_creators(db, ["orcid:1"], {"orcid:1": {"name": "John R. Doe", "tokens": ["john", "r", "doe"]}})
+    assert creators.documents["orcid:1"]["count"] == 2
+    assert creators.documents["orcid:1"]["name"] == "John R. Doe"
+    assert "r" in creators.documents["orcid:1"]["prefixes"]
+
+    # the first record is deleted
+    await update_creators(db, ["orcid:1", "name:doe jane"], {})
+    assert list(creators.documents) == ["orcid:1"]
+    assert creators.documents["orcid:1"]["count"] == 1
+
+
+@pytest.mark.asyncio
+async def test_search_creators():
+    """Test that creators are matched by name word prefixes, the most credited first"""
+
+    creators = StandInCollection()
+    db = {CREATORS_COLLECTION: creators}
+    for key, name, count in [("orcid:1", "John Doe", 1), ("name:doe jane", "Doe, Jane", 3),
+                             ("name:jon smith", "Jon Smith", 2)]:
+        for _ in range(count):
+            await update_creators(db, [], {key: {"name": name, "tokens": name_tokens(name)}})
+
+    assert await search_creators(db, "do", 10) == ["Doe, Jane", "John Doe"]
+    assert await search_creators(db, "Doe J", 10) == ["Doe, Jane", "John Doe"]
+    assert await search_creators(db, "jo", 1) == ["Jon Smith"]
+    assert await search_creators(db, "smith, jo", 10) == ["Jon Smith"]
+    assert await search_creators(db, "jane smith", 10) == []
+    assert await search_creators(db, " , ", 10) == []
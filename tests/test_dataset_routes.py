@@ -1,12 +1,45 @@
+import asyncio
+import json
+
 import pytest
+from beanie import PydanticObjectId
+from pymongo import InsertOne, monitoring
+from pymongo.errors import BulkWriteError
 
 from api.adapters.utils import RepositoryType
-from api.models.catalog import Submission
+from api.models.catalog import DatasetMetadataDOC, Submission
+from api.models.job import Job, JobStatus
 from api.models.user import SubmissionType, User, S3Path
+from api.procedures.job import _JobRunner
+from api.routes.catalog import _bulk_write_datasets
 
 pytestmark = pytest.mark.asyncio
 
 
+class CommandCounter(monitoring.CommandListener):
+    """Records the database commands sent by every mongo client created after it is registered"""
+
+    def __init__(self):
+        self.commands = []
+
+    def count(self, command_name: str, collection_name: str):
+        return sum(1 for command in self.commands if command.get(command_name) == collection_name)
+
+    def started(self, event):
+        self.commands.append(event.command)
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+# registered at import so that it is in place before the test client creates the mongo client
+command_counter = CommandCounter()
+monitoring.register(command_counter)
+
+
 @pytest.mark.asyncio
 async def test_create_dataset(client_test, dataset_data, test_user_access_token):
     """Testing the dataset routes for post and get"""
@@ -225,6 +258,120 @@ async def test_create_refresh_dataset_from_hydroshare(client_test, test_user_acc
     await _check_hs_submission(hs_dataset, test_user_access_token, hs_published_res_id)
 
 
+@pytest.mark.asyncio
+async def test_create_refresh_dataset_from_hydroshare_job(client_test, test_user_access_token):
+    """Testing catalog registration/refresh of hydroshare metadata record in background jobs"""
+
+    async def wait_for_job(job_id):
+        for _ in range(100):
+            response = await client_test.get(f"api/catalog/jobs/{job_id}")
+            assert response.status_code == 200
+            if not response.json()["active"]:
+                return response.json()
+            await asyncio.sleep(0.2)
+        pytest.fail("Job did not finish")
+
+    hs_published_res_id = "b5f58460941c49578e311adb9823657a"
+    responses = await asyncio.gather(*[
+        client_test.get(f"api/catalog/repository/hydroshare/{hs_published_res_id}", params={"job": True})
+        for _ in range(3)
+    ])
+    assert [response.status_code for response in responses] == [202, 202, 202]
+    # concurrent registrations of the same resource share one job
+    job_ids = {response.json()["_id"] for response in responses}
+    assert len(job_ids) == 1
+    job = await wait_for_job(job_ids.pop())
+    assert job["status"] == JobStatus.SUCCEEDED
+    assert job["repository"] == RepositoryType.HYDROSHARE
+    assert job["identifier"] == hs_published_res_id
+
+    response = await client_test.get(f"api/catalog/dataset/{job['dataset_id']}")
+    assert response.status_code == 200
+    await _check_hs_submission(response.json(), test_user_access_token, hs_published_res_id)
+    # the submission written by the job is seen by the next request of the user
+    response = await client_test.get(f"api/catalog/repository/hydroshare/{hs_published_res_id}")
+    assert response.status_code == 400
+
+    # a failed job records the status and the detail of the error
+    response = await client_test.get(f"api/catalog/repository/hydroshare/{hs_published_res_id}", params={"job": True})
+    assert response.status_code == 202
+    job = await wait_for_job(response.json()["_id"])
+    assert job["status"] == JobStatus.FAILED
+    assert job["status_code"] == 400
+
+    response = await client_test.put(f"api/catalog/repository/hydroshare/{hs_published_res_id}", params={"job": True})
+    assert response.status_code == 202
+    job = await wait_for_job(response.json()["_id"])
+    assert job["status"] == JobStatus.SUCCEEDED
+    await Job.find().delete()
+
+    response = await client_test.get(f"api/catalog/jobs/{PydanticObjectId()}")
+    assert response.status_code == 404
+
+    # a job added by another API instance is claimed from the job collection
+    user = await User.find_one(User.access_token == test_user_access_token)
+    job = Job(operation="hydroshare_refresh", repository=RepositoryType.HYDROSHARE, identifier=hs_published_res_id,
+              user_id=user.id)
+    await job.insert()
+    job = await wait_for_job(job.id)
+    assert job["status"] == JobStatus.SUCCEEDED
+    await Job.find().delete()
+
+
+async def test_job_heartbeat_and_claim(monkeypatch):
+    """Testing that a running job is touched until it finishes and is only completed while the claim is held"""
+
+    class StandInClaim:
+        def __init__(self):
+            self.updates = []
+            self.held = True
+
+        def __call__(self, job):
+            return self
+
+        async def update(self, expression):
+            self.updates.append(expression.query["$set"])
+            return type("UpdateResult", (), {"matched_count": int(self.held)})
+
+    async def get(user_id):
+        return User.construct(id=user_id, submissions=[])
+
+    async def fetch_all_links(self):
+        pass
+
+    async def register(identifier, user):
+        await asyncio.sleep(0.05)
+        return DatasetMetadataDOC.construct(id=PydanticObjectId())
+
+    monkeypatch.setattr(User, "get", get)
+    monkeypatch.setattr(User, "fetch_all_links", fetch_all_links)
+    # the query fields of the job document, set by init_beanie
+    for field in ("status", "dataset_id", "status_code", "detail", "active", "updated"):
+        monkeypatch.setattr(Job, field, field, raising=False)
+    runner = _JobRunner()
+    runner.register("register", register)
+    await runner.start(workers=0, poll_interval=1, stale_after=0.03)
+    claimed = StandInClaim()
+    monkeypatch.setattr(runner, "_claimed", claimed)
+
+    job = Job.construct(id=PydanticObjectId(), operation="register", identifier="a", user_id=PydanticObjectId(),
+                        claim=PydanticObjectId(), dataset_id=None, status_code=None, detail=None)
+    await runner._run(job)
+    # heartbeats every stale_after / 3 seconds, then the completion
+    assert len(claimed.updates) >= 3
+    assert all(set(update) == {"updated"} for update in claimed.updates[:-1])
+    assert claimed.updates[-1]["status"] == JobStatus.SUCCEEDED
+    assert claimed.updates[-1]["active"] is False
+
+    # a job claimed again by another worker is not completed by this one
+    claimed.updates.clear()
+    claimed.held = False
+    await runner._run(job)
+    # the heartbeat stops at the first touch that does not match the claim
+    assert [set(update) for update in claimed.updates[:-1]] == [{"updated"}]
+    assert claimed.updates[-1]["status"] == JobStatus.SUCCEEDED
+
+
 @pytest.mark.asyncio
 async def test_update_dataset(client_test, dataset_data):
     """Testing the dataset put route for updating dataset record"""
@@ -285,6 +432,34 @@ async def test_delete_dataset(client_test, dataset_data, test_user_access_token)
     assert submission_response.status_code == 200
 
 
+@pytest.mark.asyncio
+async def test_create_delete_dataset_db_writes(client_test, dataset_data, test_user_access_token):
+    """Testing that adding and removing a dataset writes only its own submission regardless of the number of
+    submissions of the user"""
+
+    for _ in range(5):
+        response = await client_test.post("api/catalog/dataset", json=dataset_data)
+        assert response.status_code == 201
+
+    command_counter.commands.clear()
+    response = await client_test.post("api/catalog/dataset", json=dataset_data)
+    assert response.status_code == 201
+    record_id = response.json()["_id"]
+    assert command_counter.count("insert", "Submission") == 1
+    assert command_counter.count("update", "Submission") == 0
+    assert command_counter.count("update", "User") == 1
+
+    command_counter.commands.clear()
+    response = await client_test.delete(f"api/catalog/dataset/{record_id}")
+    assert response.status_code == 200
+    assert command_counter.count("delete", "Submission") == 1
+    assert command_counter.count("update", "Submission") == 0
+    assert command_counter.count("update", "User") == 1
+
+    user = await User.find_one(User.access_token == test_user_access_token, fetch_links=True)
+    assert len(user.submissions) == 5
+
+
 @pytest.mark.parametrize("multiple", [True, False])
 @pytest.mark.asyncio
 async def test_get_datasets(client_test, dataset_data, multiple):
@@ -310,6 +485,139 @@ async def test_get_datasets(client_test, dataset_data, multiple):
         assert ds["submission_type"] == SubmissionType.IGUIDE_FORM
 
 
+@pytest.mark.asyncio
+async def test_get_datasets_db_calls(client_test, dataset_data):
+    """Testing that all datasets of a user are fetched with a single query regardless of the number of datasets"""
+
+    for _ in range(5):
+        dataset_response = await client_test.post("api/catalog/dataset", json=dataset_data)
+        assert dataset_response.status_code == 201
+
+    command_counter.commands.clear()
+    dataset_response = await client_test.get("api/catalog/dataset")
+    assert dataset_response.status_code == 200
+    assert len(dataset_response.json()) == 5
+    assert command_counter.count("find", "catalog") == 1
+
+
+@pytest.mark.asyncio
+async def test_bulk_create_update_datasets(client_test, dataset_data):
+    """Testing that datasets are created and updated in bulk with a status for each record"""
+
+    invalid_data = {key: value for key, value in dataset_data.items() if key != "name"}
+    response = await client_test.post("api/catalog/dataset/bulk", json=[dataset_data, invalid_data, dataset_data])
+    assert response.status_code == 207
+    results = response.json()
+    assert [result["status"] for result in results] == [201, 422, 201]
+    assert [result["index"] for result in results] == [0, 1, 2]
+    record_ids = [results[0]["_id"], results[2]["_id"]]
+
+    submission_response = await client_test.get("api/catalog/submission")
+    assert [submission["identifier"] for submission in submission_response.json()] == record_ids
+
+    # update the first dataset and create another one from an NDJSON body
+    updated_data = {**dataset_data, "_id": record_ids[0], "name": "Updated dataset"}
+    body = "\n".join(json.dumps(record) for record in [updated_data, dataset_data])
+    response = await client_test.post("api/catalog/dataset/bulk", content=body,
+                                      headers={"Content-Type": "application/x-ndjson"})
+    assert response.status_code == 207
+    assert [result["status"] for result in response.json()] == [200, 201]
+
+    dataset_response = await client_test.get(f"api/catalog/dataset/{record_ids[0]}")
+    assert dataset_response.json()["name"] == "Updated dataset"
+    submission_response = await client_test.get("api/catalog/submission")
+    assert len(submission_response.json()) == 3
+
+
+@pytest.mark.asyncio
+async def test_bulk_update_duplicate_datasets(client_test, dataset_data):
+    """Testing that a dataset updated twice in one bulk request is updated once and the duplicate is a conflict"""
+
+    response = await client_test.post("api/catalog/dataset", json=dataset_data)
+    record_id = response.json()["_id"]
+    updated_data = {**dataset_data, "_id": record_id, "name": "Updated dataset"}
+    response = await client_test.post("api/catalog/dataset/bulk", json=[updated_data, updated_data])
+    assert response.status_code == 207
+    assert [result["status"] for result in response.json()] == [200, 409]
+
+
+@pytest.mark.asyncio
+async def test_bulk_write_datasets_errors(monkeypatch):
+    """Testing that the failed writes of an unordered bulk write are reported by their position"""
+
+    class Collection:
+        async def bulk_write(self, requests, ordered=True):
+            assert not ordered
+            raise BulkWriteError({"writeErrors": [{"index": 1, "code": 11000, "errmsg": "duplicate key"},
+                                                  {"index": 2, "code": 2, "errmsg": "bad value"}]})
+
+    monkeypatch.setattr(DatasetMetadataDOC, "get_motor_collection", lambda: Collection())
+    errors = await _bulk_write_datasets([InsertOne({}), InsertOne({}), InsertOne({})])
+    assert errors == {1: {"status": 409, "detail": "duplicate key"}, 2: {"status": 500, "detail": "bad value"}}
+    assert await _bulk_write_datasets([]) == {}
+
+
+@pytest.mark.asyncio
+async def test_get_datasets_paginated(client_test, dataset_data):
+    """Testing that the datasets of a user are paginated with the cursor returned in the X-Next-Cursor header"""
+
+    record_ids = []
+    for _ in range(5):
+        dataset_response = await client_test.post("api/catalog/dataset", json=dataset_data)
+        assert dataset_response.status_code == 201
+        record_ids.append(dataset_response.json()["_id"])
+
+    pages = []
+    params = {"limit": 2}
+    while True:
+        dataset_response = await client_test.get("api/catalog/dataset", params=params)
+        assert dataset_response.status_code == 200
+        pages.append([dataset["_id"] for dataset in dataset_response.json()])
+        if "X-Next-Cursor" not in dataset_response.headers:
+            break
+        params["cursor"] = dataset_response.headers["X-Next-Cursor"]
+    assert [len(page) for page in pages] == [2, 2, 1]
+    assert [record_id for page in pages for record_id in page] == record_ids
+
+    dataset_response = await client_test.get("api/catalog/dataset", params={"cursor": str(PydanticObjectId())})
+    assert dataset_response.status_code == 400
+
+    # the submissions are paginated by submission id
+    pages = []
+    params = {"limit": 2}
+    while True:
+        submission_response = await client_test.get("api/catalog/submission", params=params)
+        assert submission_response.status_code == 200
+        pages.append([submission["identifier"] for submission in submission_response.json()])
+        if "X-Next-Cursor" not in submission_response.headers:
+            break
+        params["cursor"] = submission_response.headers["X-Next-Cursor"]
+    assert [len(page) for page in pages] == [2, 2, 1]
+    assert [record_id for page in pages for record_id in page] == record_ids
+
+
+@pytest.mark.asyncio
+async def test_get_datasets_fields(client_test, dataset_data):
+    """Testing that only the requested fields of the datasets are returned"""
+
+    dataset_response = await client_test.post("api/catalog/dataset", json=dataset_data)
+    assert dataset_response.status_code == 201
+
+    dataset_response = await client_test.get("api/catalog/dataset", params={"fields": "name,creator.name"})
+    assert dataset_response.status_code == 200
+    dataset = dataset_response.json()[0]
+    assert set(dataset) == {"_id", "name", "creator"}
+    assert dataset["name"] == dataset_data["name"]
+    assert dataset["creator"][0] == {"name": dataset_data["creator"][0]["name"]}
+
+    submission_response = await client_test.get("api/catalog/submission", params={"fields": "title"})
+    assert submission_response.status_code == 200
+    assert set(submission_response.json()[0]) == {"_id", "title"}
+
+    dataset_response = await client_test.get("api/catalog/dataset", params={"fields": "name,unknown"})
+    assert dataset_response.status_code == 400
+
+
 @pytest.mark.asyncio
 async def test_get_datasets_2(client_test, dataset_data):
     """Testing the get all datasets for a given user with different submission types"""
@@ -340,6 +648,12 @@ async def test_get_datasets_2(client_test, dataset_data):
     assert dataset_response_data[1]["submission_type"] == SubmissionType.S3
     assert dataset_response_data[1]["s3_path"] == s3_path
 
+    submission_response = await client_test.get("api/catalog/submission", params={"fields": "s3_path.bucket"})
+    assert submission_response.status_code == 200
+    submissions = submission_response.json()
+    assert set(submissions[0]) == {"_id"}
+    assert submissions[1]["s3_path"] == {"bucket": s3_path["bucket"]}
+
 
 @pytest.mark.asyncio
 async def test_get_datasets_different_submission_types(client_test, dataset_data):
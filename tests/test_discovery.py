@@ -0,0 +1,322 @@
+import asyncio
+from datetime import datetime
+from types import SimpleNamespace
+
+import orjson
+import pytest
+from fastapi import HTTPException
+from pydantic import ValidationError
+
+from api.procedures.spatial import spatial_coverage_geometry
+from api.config import get_settings
+from api.routes import discovery
+from api.routes.discovery import FIRST_PAGE_CURSOR, SearchQuery, _search, facets, search_batch
+
+
+@pytest.mark.parametrize('sort_by', [None, "name", "dateCreated"])
+@pytest.mark.asyncio
+async def test_search_query_cursor_stages(sort_by):
+    """Test that a cursor paginated search sorts within $search and never skips earlier hits"""
+
+    search_query = SearchQuery(term="water", sortBy=sort_by, cursor=FIRST_PAGE_CURSOR)
+    stages = search_query.stages
+    search_stage = stages[0]["$search"]
+    assert "sort" in search_stage
+    assert "searchAfter" not in search_stage
+    assert not any("$skip" in stage or "$sort" in stage for stage in stages)
+
+    search_query = SearchQuery(term="water", sortBy=sort_by, cursor="token")
+    assert search_query.stages[0]["$search"]["searchAfter"] == "token"
+
+
+@pytest.mark.asyncio
+async def test_search_query_cursor_page():
+    """Test that the next cursor is taken from the last hit even when it is below the relevance threshold"""
+
+    search_query = SearchQuery(term="water", pageSize=2, cursor=FIRST_PAGE_CURSOR)
+    results = [
+        {"name": "first", "score": 10, "paginationToken": "a"},
+        {"name": "second", "score": 0, "paginationToken": "b"},
+    ]
+    page = search_query.cursor_page(results)
+    assert page["nextCursor"] == "b"
+    assert [item["name"] for item in page["items"]] == ["first"]
+    assert "paginationToken" not in page["items"][0]
+
+    page = search_query.cursor_page(results[:1])
+    assert page["nextCursor"] is None
+
+
+@pytest.mark.asyncio
+async def test_search_query_cursor_with_page_number():
+    """Test that cursor pagination can not be combined with pageNumber"""
+
+    with pytest.raises(ValidationError):
+        SearchQuery(pageNumber=2, cursor=FIRST_PAGE_CURSOR)
+
+
+@pytest.mark.asyncio
+async def test_search_query_facet_stages():
+    """Test that all facets are counted by a single $searchMeta stage using the search filters"""
+
+    search_query = SearchQuery(term="water", providerName="HydroShare", publishedStart=2020, publishedEnd=2022)
+    stages = search_query.facet_stages
+    assert len(stages) == 1
+    search_meta = stages[0]["$searchMeta"]
+    assert search_meta["facet"]["operator"]["compound"]["minimumShouldMatch"] == 1
+    facets = search_meta["facet"]["facets"]
+    assert set(facets) == {"contentType", "providerName", "submissionType", "contentLocation", "publicationYear"}
+    assert [boundary.year for boundary in facets["publicationYear"]["boundaries"]] == [2020, 2021, 2022, 2023]
+
+
+@pytest.mark.parametrize('params, years', [
+    ({"publishedEnd": 1995}, [1995, 1996]),
+    ({"publishedStart": 2990}, [2990, 2991]),
+    ({"publishedStart": 1990, "publishedEnd": 1990}, [1990, 1991]),
+    ({"publishedStart": 2020, "publishedEnd": 2022}, [2020, 2021, 2022, 2023]),
+])
+@pytest.mark.asyncio
+async def test_search_query_publication_year_boundaries(params, years):
+    """Test that the publication year facet always has at least two boundaries covering the published range"""
+
+    search_query = SearchQuery(**params)
+    facets = search_query.facet_stages[0]["$searchMeta"]["facet"]["facets"]
+    boundaries = [boundary.year for boundary in facets["publicationYear"]["boundaries"]]
+    assert boundaries == years
+
+
+@pytest.mark.parametrize('params', [{"publishedStart": 1}, {"publishedEnd": 9998},
+                                    {"publishedStart": 2000, "publishedEnd": 2200}])
+@pytest.mark.asyncio
+async def test_facets_publication_year_limit(params, monkeypatch):
+    """Test that facets over more publication years than search_facet_max_years are rejected"""
+
+    monkeypatch.setattr(get_settings(), "search_facet_max_years", 200)
+    request = SimpleNamespace(app=SimpleNamespace(mongodb={}))
+    with pytest.raises(HTTPException) as exc_info:
+        await facets(request, SearchQuery(**params))
+    assert exc_info.value.status_code == 422
+
+
+@pytest.mark.asyncio
+async def test_search_query_last_year():
+    """Test that a year is rejected when the year after it can not be filtered on"""
+
+    assert SearchQuery(publishedStart=2000, publishedEnd=9998).stages
+    with pytest.raises(ValidationError):
+        SearchQuery(publishedStart=2000, publishedEnd=9999)
+
+
+@pytest.mark.asyncio
+async def test_search_query_facet_counts():
+    """Test that $searchMeta facet buckets are converted to the facets response"""
+
+    search_meta = {
+        "count": {"total": 3},
+        "facet": {
+            "providerName": {"buckets": [{"_id": "HydroShare", "count": 2}, {"_id": "I-GUIDE", "count": 1}]},
+            "publicationYear": {"buckets": [{"_id": datetime(2021, 1, 1), "count": 2}, {"_id": "other", "count": 1}]},
+        },
+    }
+    counts = SearchQuery.facet_counts(search_meta)
+    assert counts["total"] == 3
+    assert counts["facets"]["providerName"] == [{"value": "HydroShare", "count": 2}, {"value": "I-GUIDE", "count": 1}]
+    assert counts["facets"]["publicationYear"] == [{"value": 2021, "count": 2}, {"value": "other", "count": 1}]
+
+
+@pytest.mark.asyncio
+async def test_search_query_with_total():
+    """Test that the total hit count is read from $$SEARCH_META in the same aggregate as the page, after $limit"""
+
+    search_query = SearchQuery(term="water", withTotal=True)
+    stages = search_query.stages
+    assert stages[0]["$search"]["count"] == {"type": "total"}
+    assert "minimumShouldMatch" not in stages[0]["$search"]["compound"]
+    stage_names = [next(iter(stage)) for stage in stages]
+    assert stage_names.index("$limit") < stage_names.index("$match") < stage_names.index("$facet")
+    assert stages[-1] == {"$facet": {"items": [], "meta": [{"$replaceWith": "$$SEARCH_META"}, {"$limit": 1}]}}
+
+    results = [{"items": [{"name": "first", "score": 10}], "meta": [{"count": {"total": 42}}]}]
+    assert search_query.page(results) == {"items": [{"name": "first", "score": 10}], "total": 42}
+    assert search_query.page([{"items": [], "meta": []}]) == {"items": [], "total": 0}
+
+
+class StandInDiscovery:
+    """Runs the stages of a search over a list of records, every record is a hit of $search"""
+
+    def __init__(self, records):
+        self.records = records
+        self.aggregates = 0
+
+    def aggregate(self, stages):
+        self.aggregates += 1
+        search_meta = {"count": {"total": len(self.records)}}
+        documents = [dict(record) for record in self.records]
+        for stage in stages[1:]:
+            if "$skip" in stage:
+                documents = documents[stage["$skip"]:]
+            if "$limit" in stage:
+                documents = documents[:stage["$limit"]]
+            if "$match" in stage:
+                documents = [document for document in documents if document["score"] > stage["$match"]["score"]["$gt"]]
+            if "$facet" in stage:
+                documents = [{"items": documents, "meta": [search_meta] if documents else []}]
+
+        class Cursor:
+            async def to_list(self, length):
+                return documents
+
+        return Cursor()
+
+
+@pytest.mark.asyncio
+async def test_search_with_total_single_aggregate(monkeypatch):
+    """Test that a search with the total hit count runs a single aggregate and that the relevance score threshold
+    applies to the items only"""
+
+    monkeypatch.setattr(get_settings(), "search_relevance_score_threshold", 1.4)
+    records = [{"name": f"water {i}", "score": 2} for i in range(3)] + [{"name": "soil", "score": 1}]
+    discovery = StandInDiscovery(records)
+    db = {"discovery": discovery}
+
+    search_query = SearchQuery(term="water", pageSize=2, pageNumber=2, withTotal=True)
+    response = orjson.loads(await _search(db, search_query))
+    assert response == {"items": [{"name": "water 2", "score": 2}], "total": 4}
+    assert discovery.aggregates == 1
+
+
+@pytest.fixture
+def batch_searches(monkeypatch):
+    """Replaces the cached search with one that finishes the later searches first and records how many searches
+    run at the same time"""
+
+    running = {"now": 0, "max": 0}
+
+    async def get_version(db, name):
+        return 1
+
+    async def cached_search(db, search_query, version):
+        running["now"] += 1
+        running["max"] = max(running["max"], running["now"])
+        await asyncio.sleep(0.01 / search_query.pageNumber)
+        running["now"] -= 1
+        return orjson.dumps({"pageNumber": search_query.pageNumber})
+
+    monkeypatch.setattr(discovery, "get_version", get_version)
+    monkeypatch.setattr(discovery, "_cached_search", cached_search)
+    return running
+
+
+@pytest.mark.asyncio
+async def test_search_batch_order(batch_searches, monkeypatch):
+    """Test that the results of a batch are in the order of the queries and that at most search_batch_concurrency
+    searches run at the same time"""
+
+    monkeypatch.setattr(get_settings(), "search_batch_concurrency", 3)
+    request = SimpleNamespace(app=SimpleNamespace(mongodb={}))
+    search_queries = [SearchQuery(term="water", pageNumber=page_number) for page_number in range(1, 11)]
+
+    response = await search_batch(request, search_queries)
+    assert [result["pageNumber"] for result in orjson.loads(response.body)] == list(range(1, 11))
+    assert batch_searches["max"] == 3
+
+
+@pytest.mark.asyncio
+async def test_search_batch_max_size(batch_searches, monkeypatch):
+    """Test that a batch with more than search_batch_max_size queries is rejected"""
+
+    monkeypatch.setattr(get_settings(), "search_batch_max_size", 2)
+    request = SimpleNamespace(app=SimpleNamespace(mongodb={}))
+
+    response = await search_batch(request, [SearchQuery(term="water"), SearchQuery(term="soil")])
+    assert len(orjson.loads(response.body)) == 2
+
+    with pytest.raises(HTTPException) as exc_info:
+        await search_batch(request, [SearchQuery(term="water")] * 3)
+    assert exc_info.value.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_search_query_stream_stages():
+    """Test that a streamed search is sorted within $search and is not paginated"""
+
+    search_query = SearchQuery(term="water", sortBy="name", pageNumber=3)
+    stages = search_query.stream_stages
+    assert stages[0]["$search"]["sort"] == {"name": 1, "_id": 1}
+    assert not any("$skip" in stage or "$limit" in stage for stage in stages)
+
+
+@pytest.mark.parametrize('params', [{}, {"term": "water"}, {"cursor": FIRST_PAGE_CURSOR}])
+@pytest.mark.asyncio
+async def test_search_query_unset_creator_keys(params):
+    """Test that the creator keys stored by the catalog trigger are not returned by the searches"""
+
+    search_query = SearchQuery(**params)
+    assert {'$unset': 'creator_keys'} in search_query.stages
+    assert {'$unset': 'creator_keys'} in search_query.stream_stages
+
+
+@pytest.mark.asyncio
+async def test_search_query_geo_filters():
+    """Test that bbox and near are pushed into the $search compound filter"""
+
+    search_query = SearchQuery(bbox="-112,41,-111,42", near="-111.8,41.7", radius=5000)
+    geo_shape, geo_within = search_query.stages[0]["$search"]["compound"]["filter"]
+    assert geo_shape["geoShape"]["relation"] == "intersects"
+    assert geo_shape["geoShape"]["geometry"]["coordinates"][0][0] == [-112, 41]
+    assert geo_within["geoWithin"]["circle"] == {
+        "center": {"type": "Point", "coordinates": [-111.8, 41.7]},
+        "radius": 5000,
+    }
+
+
+@pytest.mark.parametrize('params', [{"bbox": "-112,41,-111"}, {"bbox": "-112,43,-111,42"}, {"near": "41.7,-111.8"},
+                                    {"radius": 100}, {"near": "-111.8,41.7", "radius": 0}])
+@pytest.mark.asyncio
+async def test_search_query_geo_validation(params):
+    """Test that invalid geospatial parameters are rejected"""
+
+    with pytest.raises(ValidationError):
+        SearchQuery(**params)
+
+
+@pytest.mark.asyncio
+async def test_search_query_bbox_antimeridian():
+    """Test that a bbox crossing the antimeridian is split into a polygon on each side of it"""
+
+    search_query = SearchQuery(bbox="170,-10,-170,10")
+    geometry = search_query.stages[0]["$search"]["compound"]["filter"][0]["geoShape"]["geometry"]
+    assert geometry == {
+        "type": "MultiPolygon",
+        "coordinates": [
+            [[[170, -10], [180, -10], [180, 10], [170, 10], [170, -10]]],
+            [[[-180, -10], [-170, -10], [-170, 10], [-180, 10], [-180, -10]]],
+        ],
+    }
+
+
+@pytest.mark.asyncio
+async def test_search_query_bbox_whole_world():
+    """Test that a bbox of the whole world is split into polygons narrower than 180 degrees"""
+
+    search_query = SearchQuery(bbox="-180,-90,180,90")
+    geometry = search_query.stages[0]["$search"]["compound"]["filter"][0]["geoShape"]["geometry"]
+    assert geometry["type"] == "MultiPolygon"
+    edges = [(polygon[0][0][0], polygon[0][1][0]) for polygon in geometry["coordinates"]]
+    assert edges == [(-180, -60), (-60, 60), (60, 180)]
+    assert all(polygon[0][0][1] == -90 and polygon[0][2][1] == 90 for polygon in geometry["coordinates"])
+
+
+@pytest.mark.asyncio
+async def test_spatial_coverage_geometry():
+    """Test that spatial coverage boxes and coordinates are converted to GeoJSON"""
+
+    geometry = spatial_coverage_geometry({"geo": {"@type": "GeoShape", "box": "42.0 -111.0 41.0 -112.0"}})
+    assert geometry["type"] == "Polygon"
+    assert geometry["coordinates"][0] == [[-112, 41], [-111, 41], [-111, 42], [-112, 42], [-112, 41]]
+    geometry = spatial_coverage_geometry({"geo": {"@type": "GeoShape", "box": "40.1126 -88.2249 40.1126 -88.2249"}})
+    assert geometry == {"type": "Point", "coordinates": [-88.2249, 40.1126]}
+    geometry = spatial_coverage_geometry({"geo": {"@type": "GeoCoordinates", "latitude": 41.74, "longitude": -111.83}})
+    assert geometry == {"type": "Point", "coordinates": [-111.83, 41.74]}
+    assert spatial_coverage_geometry({"name": "Logan River"}) is None
+    assert spatial_coverage_geometry(None) is None
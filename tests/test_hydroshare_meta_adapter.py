@@ -1,9 +1,19 @@
+import asyncio
+import json
+import threading
+import time
 from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
 import pytest
+from beanie import init_beanie
 from pydantic import ValidationError
 
+from api.adapters.base import NOT_MODIFIED, CircuitBreaker, CircuitState, HttpCache, circuit_breakers
 from api.adapters.utils import RepositoryType, get_adapter_by_type
+from api.exceptions import RepositoryException
 from api.models.catalog import DatasetMetadataDOC
+from api.models.http_cache import HttpCacheEntry
 
 
 @pytest.mark.parametrize('coverage_type', ["box", "point"])
@@ -129,3 +139,231 @@ async def test_get_adapter_by_type():
     for repo_type in RepositoryType.__members__.values():
         adapter = get_adapter_by_type(repo_type)
         assert adapter is not None
+
+
+@pytest.mark.asyncio
+async def test_hydroshare_request_handler_unreachable(monkeypatch):
+    """Test that a HydroShare connection failure is raised as a repository exception instead of blocking"""
+
+    adapter = get_adapter_by_type(RepositoryType.HYDROSHARE)
+    monkeypatch.setattr(adapter.repo_api_handler.settings, "hydroshare_meta_read_url",
+                        "http://127.0.0.1:1/hsapi2/resource/%s/json/")
+    monkeypatch.setattr(adapter.repo_api_handler.settings, "repository_retry_base_delay", 0.01)
+    monkeypatch.setattr(circuit_breakers, "_breakers", {})
+    with pytest.raises(RepositoryException) as exc_info:
+        await adapter.get_metadata("1ee81318135c40f587d9a3e5d689daf5")
+    assert exc_info.value.status_code == 502
+
+
+class MockHydroShare(BaseHTTPRequestHandler):
+    """Serves a resource with 10 pages of 2 files and records the number of concurrent requests. With an etag the
+    responses carry the etag and requests with a matching If-None-Match are answered with a 304."""
+
+    lock = threading.Lock()
+    in_flight = 0
+    max_in_flight = 0
+    etag = None
+    # number of requests answered with a 503 before the server recovers
+    failures = 0
+    requests = 0
+
+    def do_GET(self):
+        with self.lock:
+            MockHydroShare.in_flight += 1
+            MockHydroShare.max_in_flight = max(MockHydroShare.max_in_flight, MockHydroShare.in_flight)
+            MockHydroShare.requests += 1
+            failing = MockHydroShare.failures > 0
+            if failing:
+                MockHydroShare.failures -= 1
+        time.sleep(0.02)
+        if failing:
+            self.send_error(503)
+            with self.lock:
+                MockHydroShare.in_flight -= 1
+            return
+        if self.etag and self.headers.get("If-None-Match") == self.etag:
+            self.send_response(304)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            with self.lock:
+                MockHydroShare.in_flight -= 1
+            return
+        if "/files/" in self.path:
+            page = int(self.path.rsplit("page=", 1)[-1]) if "page=" in self.path else 1
+            next_url = None
+            if page < 10:
+                next_url = f"http://{self.headers['Host']}/hsapi/resource/test/files/?page={page + 1}"
+            body = {"count": 20, "next": next_url, "results": [{"file": f"{page}-{i}"} for i in range(2)]}
+        else:
+            body = {"title": "Mock resource"}
+        content = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        if self.etag:
+            self.send_header("ETag", self.etag)
+        self.end_headers()
+        self.wfile.write(content)
+        with self.lock:
+            MockHydroShare.in_flight -= 1
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def mock_hydroshare(monkeypatch):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), MockHydroShare)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host = f"http://127.0.0.1:{server.server_port}"
+    settings = get_adapter_by_type(RepositoryType.HYDROSHARE).repo_api_handler.settings
+    monkeypatch.setattr(settings, "hydroshare_meta_read_url", f"{host}/hsapi2/resource/%s/json/")
+    monkeypatch.setattr(settings, "hydroshare_file_read_url", f"{host}/hsapi/resource/%s/files/")
+    monkeypatch.setattr(settings, "hydroshare_file_page_concurrency", 3)
+    monkeypatch.setattr(settings, "repository_retry_base_delay", 0.01)
+    MockHydroShare.max_in_flight = 0
+    MockHydroShare.etag = None
+    MockHydroShare.failures = 0
+    MockHydroShare.requests = 0
+    yield MockHydroShare
+    server.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_hydroshare_request_handler_file_pages(mock_hydroshare):
+    """Test that the file list pages are fetched concurrently with a bounded fan-out and merged in order"""
+
+    adapter = get_adapter_by_type(RepositoryType.HYDROSHARE)
+    metadata = await adapter.get_metadata("test")
+    assert metadata["title"] == "Mock resource"
+    assert [file["file"] for file in metadata["content_files"]] == [
+        f"{page}-{i}" for page in range(1, 11) for i in range(2)
+    ]
+    assert 1 < mock_hydroshare.max_in_flight <= 3
+
+
+@pytest.mark.asyncio
+async def test_hydroshare_request_handler_not_modified(client_test, mock_hydroshare):
+    """Test that a refresh is conditional on the validators saved for the same record and returns NOT_MODIFIED"""
+
+    await init_beanie(database=client_test.app.mongodb, document_models=[HttpCacheEntry])
+    await HttpCacheEntry.find().delete()
+    adapter = get_adapter_by_type(RepositoryType.HYDROSHARE)
+    mock_hydroshare.etag = '"v1"'
+
+    http_cache = HttpCache(scope="first")
+    metadata = await adapter.get_metadata("test", http_cache=http_cache)
+    assert len(metadata["content_files"]) == 20
+    # validators are only used once saved
+    assert await adapter.get_metadata("test", http_cache=HttpCache(scope="first")) is not NOT_MODIFIED
+    await http_cache.save()
+    assert await adapter.get_metadata("test", http_cache=HttpCache(scope="first")) is NOT_MODIFIED
+    assert await adapter.get_metadata("test", http_cache=HttpCache(scope="second")) is not NOT_MODIFIED
+
+    mock_hydroshare.etag = '"v2"'
+    metadata = await adapter.get_metadata("test", http_cache=HttpCache(scope="first"))
+    assert len(metadata["content_files"]) == 20
+    await HttpCacheEntry.find().delete()
+
+
+@pytest.mark.asyncio
+async def test_hydroshare_request_handler_retry(mock_hydroshare):
+    """Test that 5xx responses are retried and the last one is returned once the attempts are used up"""
+
+    adapter = get_adapter_by_type(RepositoryType.HYDROSHARE)
+    mock_hydroshare.failures = 2
+    metadata = await adapter.get_metadata("test")
+    assert len(metadata["content_files"]) == 20
+    # both first requests failed once
+    assert mock_hydroshare.requests == 2 + 2 + 9
+
+    mock_hydroshare.failures = 3
+    mock_hydroshare.requests = 0
+    with pytest.raises(RepositoryException) as exc_info:
+        await adapter.repo_api_handler._get_json(
+            f"{adapter.repo_api_handler.settings.hydroshare_meta_read_url}" % "test"
+        )
+    assert exc_info.value.status_code == 503
+    assert mock_hydroshare.requests == 3
+
+
+@pytest.mark.asyncio
+async def test_circuit_breaker():
+    """Test that the circuit breaker opens after consecutive failures and lets one trial request through later"""
+
+    breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=0.05)
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitState.CLOSED
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitState.OPEN
+    assert not breaker.allow()
+
+    time.sleep(0.05)
+    assert breaker.allow()
+    assert breaker.state == CircuitState.HALF_OPEN
+    # only one trial request
+    assert not breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitState.OPEN
+
+    time.sleep(0.05)
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CircuitState.CLOSED
+    assert breaker.stats() == {"state": CircuitState.CLOSED, "consecutive_failures": 0, "requests": 4, "successes": 1,
+                               "failures": 3, "retries": 0, "rejected": 2, "opened": 2}
+
+
+@pytest.mark.asyncio
+async def test_hydroshare_request_handler_circuit_open(monkeypatch):
+    """Test that requests to a repository fail fast while its circuit breaker is open"""
+
+    adapter = get_adapter_by_type(RepositoryType.HYDROSHARE)
+    settings = adapter.repo_api_handler.settings
+    monkeypatch.setattr(settings, "hydroshare_meta_read_url", "http://127.0.0.1:1/hsapi2/resource/%s/json/")
+    monkeypatch.setattr(settings, "hydroshare_file_read_url", "http://127.0.0.1:1/hsapi/resource/%s/files/")
+    monkeypatch.setattr(settings, "repository_retry_base_delay", 0.01)
+    monkeypatch.setattr(settings, "repository_breaker_failure_threshold", 2)
+    monkeypatch.setattr(circuit_breakers, "_breakers", {})
+    with pytest.raises(RepositoryException) as exc_info:
+        await adapter.get_metadata("test")
+    # the failed metadata and file list requests opened the breaker, the retry is rejected
+    assert exc_info.value.status_code == 503
+    stats = circuit_breakers.stats()["127.0.0.1:1"]
+    assert stats["state"] == CircuitState.OPEN
+    assert stats["requests"] == 2
+    assert stats["rejected"] >= 1
+
+    start = time.perf_counter()
+    with pytest.raises(RepositoryException) as exc_info:
+        await adapter.get_metadata("test")
+    assert exc_info.value.status_code == 503
+    assert time.perf_counter() - start < 0.1
+
+
+@pytest.mark.asyncio
+async def test_circuit_breaker_cancelled_trial(mock_hydroshare, monkeypatch):
+    """Test that a cancelled trial request of a half open breaker does not keep the breaker from letting requests
+    through"""
+
+    adapter = get_adapter_by_type(RepositoryType.HYDROSHARE)
+    url = adapter.repo_api_handler.settings.hydroshare_meta_read_url % "test"
+    monkeypatch.setattr(circuit_breakers, "_breakers", {})
+    breaker = circuit_breakers.get(url)
+    breaker.reset_timeout = 0
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure()
+    assert breaker.state == CircuitState.OPEN
+
+    trial = asyncio.create_task(adapter.repo_api_handler.http_get(url))
+    await asyncio.sleep(0.005)
+    assert breaker.state == CircuitState.HALF_OPEN
+    trial.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await trial
+
+    response = await adapter.repo_api_handler.http_get(url)
+    assert response.status_code == 200
+    assert breaker.state == CircuitState.CLOSED
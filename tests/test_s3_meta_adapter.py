@@ -0,0 +1,152 @@
+import io
+import json
+
+import boto3
+import pytest
+from botocore.response import StreamingBody
+
+from api.adapters.s3 import _S3ClientPool, _S3RequestHandler, s3_client_pool
+from api.adapters.utils import RepositoryType, get_adapter_by_type
+from api.config import get_settings
+from api.exceptions import RepositoryException
+
+moto_server = pytest.importorskip("moto.server")
+
+
+@pytest.fixture
+def s3_endpoint(monkeypatch):
+    """A local moto S3 server with a public `test` bucket"""
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "test")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "test")
+    server = moto_server.ThreadedMotoServer(ip_address="127.0.0.1", port=0, verbose=False)
+    server.start()
+    host, port = server.get_host_and_port()
+    endpoint_url = f"http://{host}:{port}"
+    s3 = boto3.client("s3", endpoint_url=endpoint_url, region_name="us-east-1")
+    s3.create_bucket(Bucket="test")
+    yield endpoint_url, s3
+    server.stop()
+
+
+@pytest.mark.asyncio
+async def test_s3_request_handler(s3_endpoint, dataset_data):
+    """Test that S3 metadata files are fetched with one reused client per endpoint"""
+
+    endpoint_url, s3 = s3_endpoint
+    s3.put_object(Bucket="test", Key="data/metadata.json", Body=json.dumps(dataset_data), ACL="public-read")
+    adapter = get_adapter_by_type(RepositoryType.S3)
+
+    metadata = await adapter.get_metadata(f"{endpoint_url}+test+data/metadata.json")
+    assert metadata == dataset_data
+    client = s3_client_pool.client(endpoint_url)
+    await adapter.get_metadata(f"{endpoint_url}+test+data/metadata.json")
+    assert s3_client_pool.client(endpoint_url) is client
+
+    with pytest.raises(RepositoryException) as exc_info:
+        await adapter.get_metadata(f"{endpoint_url}+test+data/missing.json")
+    assert exc_info.value.status_code == 404
+
+    # content that is not UTF-8 is invalid JSON content
+    s3.put_object(Bucket="test", Key="data/latin1.json", Body='{"name": "caf\u00e9"}'.encode("latin-1"))
+    with pytest.raises(RepositoryException) as exc_info:
+        await adapter.get_metadata(f"{endpoint_url}+test+data/latin1.json")
+    assert exc_info.value.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_s3_client_pool_bounded(monkeypatch):
+    """Test that the least recently used client is closed once more than s3_max_clients endpoints are used"""
+
+    monkeypatch.setattr(get_settings(), "s3_max_clients", 2)
+    pool = _S3ClientPool()
+    first = pool.client("http://first.example.org")
+    second = pool.client("http://second.example.org")
+    closed = []
+    monkeypatch.setattr(second, "close", lambda: closed.append("second"))
+    assert pool.client("http://first.example.org") is first
+
+    # the second endpoint is the least recently used one
+    pool.client("http://third.example.org")
+    assert closed == ["second"]
+    assert pool.client("http://first.example.org") is first
+    assert pool.client("http://second.example.org") is not second
+    assert len(pool._clients) == 2
+
+
+@pytest.mark.asyncio
+async def test_s3_metadata_max_size(s3_endpoint, dataset_data, monkeypatch):
+    """Test that metadata files larger than the configured maximum size are rejected without being read"""
+
+    endpoint_url, s3 = s3_endpoint
+    content = json.dumps(dataset_data).encode()
+    s3.put_object(Bucket="test", Key="size/metadata.json", Body=content, ACL="public-read")
+    adapter = get_adapter_by_type(RepositoryType.S3)
+
+    monkeypatch.setattr(get_settings(), "s3_metadata_max_size", len(content))
+    assert await adapter.get_metadata(f"{endpoint_url}+test+size/metadata.json") == dataset_data
+
+    monkeypatch.setattr(get_settings(), "s3_metadata_max_size", len(content) - 1)
+    with pytest.raises(RepositoryException) as exc_info:
+        await adapter.get_metadata(f"{endpoint_url}+test+size/metadata.json")
+    assert exc_info.value.status_code == 413
+
+    # a body without a content length is closed once more than the maximum size is read
+    monkeypatch.setattr(get_settings(), "s3_metadata_max_size", 1024)
+    raw = io.BytesIO(b" " * 1024 * 1024)
+    with pytest.raises(RepositoryException) as exc_info:
+        _S3RequestHandler._read_body({"Body": StreamingBody(raw, None)}, "test", "size/large.json")
+    assert exc_info.value.status_code == 413
+    assert raw.closed
+
+
+@pytest.mark.asyncio
+async def test_s3_list_metadata_files(s3_endpoint):
+    """Test that the metadata files under a prefix are listed across pages of ListObjectsV2"""
+
+    endpoint_url, s3 = s3_endpoint
+    for i in range(1005):
+        s3.put_object(Bucket="test", Key=f"listing/{i:04}.json", Body=b"{}")
+    s3.put_object(Bucket="test", Key="listing/readme.txt", Body=b"")
+    s3.put_object(Bucket="test", Key="other/metadata.json", Body=b"{}")
+    adapter = get_adapter_by_type(RepositoryType.S3)
+
+    keys = await adapter.list_metadata_files(endpoint_url, "test", "listing/", max_keys=2000)
+    assert keys == [f"listing/{i:04}.json" for i in range(1005)]
+
+    with pytest.raises(RepositoryException) as exc_info:
+        await adapter.list_metadata_files(endpoint_url, "test", "listing/", max_keys=1000)
+    assert exc_info.value.status_code == 413
+
+    with pytest.raises(RepositoryException) as exc_info:
+        await adapter.list_metadata_files(endpoint_url, "missing", "listing/", max_keys=1000)
+    assert exc_info.value.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_register_s3_prefix(client_test, s3_endpoint, dataset_data):
+    """Test that the metadata files under a prefix are registered in bulk and registered files are skipped"""
+
+    endpoint_url, s3 = s3_endpoint
+    invalid_data = {key: value for key, value in dataset_data.items() if key != "name"}
+    s3.put_object(Bucket="test", Key="prefix/a.json", Body=json.dumps(dataset_data), ACL="public-read")
+    s3.put_object(Bucket="test", Key="prefix/b.json", Body=json.dumps(invalid_data), ACL="public-read")
+    s3.put_object(Bucket="test", Key="prefix/c.json", Body=b"not json", ACL="public-read")
+    s3_prefix = {"endpoint_url": endpoint_url, "bucket": "test", "prefix": "prefix/"}
+
+    response = await client_test.put("api/catalog/repository/s3/prefix", json=s3_prefix)
+    assert response.status_code == 207
+    results = response.json()
+    assert [(result["key"], result["status"]) for result in results] == [
+        ("prefix/a.json", 201), ("prefix/b.json", 422), ("prefix/c.json", 400)
+    ]
+    submission_response = await client_test.get("api/catalog/submission")
+    submissions = submission_response.json()
+    assert [submission["identifier"] for submission in submissions] == [results[0]["_id"]]
+    assert submissions[0]["repository"] == RepositoryType.S3
+    assert submissions[0]["s3_path"]["path"] == "prefix/a.json"
+
+    s3.put_object(Bucket="test", Key="prefix/d.json", Body=json.dumps(dataset_data), ACL="public-read")
+    response = await client_test.put("api/catalog/repository/s3/prefix", json=s3_prefix)
+    assert [result["status"] for result in response.json()] == [409, 422, 400, 201]
+    submission_response = await client_test.get("api/catalog/submission")
+    assert len(submission_response.json()) == 2
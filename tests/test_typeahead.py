@@ -0,0 +1,38 @@
+import pytest
+
+from api.typeahead import TypeaheadIndex
+
+
+@pytest.mark.asyncio
+async def test_typeahead_index_search():
+    """Test that terms are found by prefix and ranked by the number of records containing them"""
+
+    index = TypeaheadIndex()
+    index.add({"_id": 1, "name": "Snow water equivalent", "description": "Logan River snowpack", "keywords": ["UEB"]})
+    index.add({"_id": 2, "name": "Snowmelt model", "description": "Snow melt", "keywords": [{"name": "Snow Cover"}]})
+
+    hints = index.search("sno", limit=10)
+    values = [hint["highlights"][0]["texts"][0]["value"] for hint in hints]
+    assert values[0] == "Snow"
+    assert set(values) == {"Snow", "snowpack", "Snowmelt", "Snow Cover"}
+    assert index.search("snow c", limit=10)[0]["highlights"][0]["path"] == "keywords"
+    # terms of 3 characters or less are not indexed
+    assert index.search("ueb", limit=10) == []
+    assert index.search("sno", limit=1) == hints[:1]
+
+
+@pytest.mark.asyncio
+async def test_typeahead_index_update_and_remove():
+    """Test that updated and removed records no longer contribute their terms"""
+
+    index = TypeaheadIndex()
+    index.add({"_id": 1, "name": "Snow water", "description": "", "keywords": []})
+    index.add({"_id": 2, "name": "Snow depth", "description": "", "keywords": []})
+    index.add({"_id": 1, "name": "Rainfall", "description": "", "keywords": []})
+    assert index.search("wat", limit=10) == []
+    assert index.search("snow", limit=10)[0]["highlights"][0]["score"] == 1
+
+    index.remove(2)
+    assert index.search("snow", limit=10) == []
+    assert index.search("depth", limit=10) == []
+    assert len(index) == 1
@@ -1,4 +1,5 @@
 import logging
+from http import HTTPStatus
 
 import typer
 from beanie import init_beanie
@@ -6,22 +7,31 @@ from motor.motor_asyncio import AsyncIOMotorClient
 from rocketry import Rocketry
 from rocketry.conds import daily
 
+from api.adapters.base import NOT_MODIFIED, HttpCache
 from api.adapters.utils import RepositoryType, get_adapter_by_type
+from api.cache import increment_version
 from api.config import get_settings
+from api.exceptions import RepositoryException
 from api.models.catalog import DatasetMetadataDOC
-from api.models.user import Submission
+from api.models.http_cache import HttpCacheEntry
+from api.models.user import Submission, User
+from api.procedures.creators import update_creators
 
 app = Rocketry(config={"task_execution": "async"})
 logger = logging.getLogger()
 
 
-async def retrieve_repository_record(submission: Submission):
-    """Retrieve the repository record from the repository and return it as a Catalog Record"""
+async def retrieve_repository_record(submission: Submission, http_cache: HttpCache = None):
+    """Retrieve the repository record from the repository and return it as a Catalog Record, or NOT_MODIFIED if the
+    record has not changed since it was last retrieved"""
     if submission.repository in RepositoryType.__members__:
         adapter = get_adapter_by_type(RepositoryType[submission.repository])
         try:
-            repo_record_metadata = await adapter.get_metadata(submission.repository_identifier)
+            repo_record_metadata = await adapter.get_metadata(submission.repository_identifier, http_cache=http_cache)
         except Exception as err:
+            if isinstance(err, RepositoryException) and err.status_code >= HTTPStatus.INTERNAL_SERVER_ERROR:
+                # the repository is unavailable, the record is not known to be gone
+                raise
             if hasattr(err, "detail"):
                 err_details = err.detail
             else:
@@ -31,6 +41,8 @@ async def retrieve_repository_record(submission: Submission):
                        f"for record id: {submission.repository_identifier}: {err_details}")
             logger.error(err_msg)
             return None
+        if repo_record_metadata is NOT_MODIFIED:
+            return NOT_MODIFIED
         return adapter.to_catalog_record(repo_record_metadata)
     else:
         err_msg = f"Repository type {submission.repository} is not supported"
@@ -42,19 +54,22 @@ async def retrieve_repository_record(submission: Submission):
 async def do_daily():
     settings = get_settings()
     db = AsyncIOMotorClient(settings.db_connection_string)[settings.database_name]
-    await init_beanie(database=db, document_models=[Submission, DatasetMetadataDOC])
+    await init_beanie(database=db, document_models=[Submission, DatasetMetadataDOC, HttpCacheEntry, User])
 
     async for submission in Submission.find(Submission.repository != None):
         if submission.repository == RepositoryType.S3:
             # skip S3 submissions as they are not yet supported for scheduled refresh
             continue
+        http_cache = HttpCache(scope=str(submission.id))
         try:
             dataset = await DatasetMetadataDOC.get(submission.identifier)
             if dataset is None:
                 logger.warning(f"No catalog record was found for submission: {submission.identifier}")
                 continue
 
-            updated_dataset = await retrieve_repository_record(submission)
+            updated_dataset = await retrieve_repository_record(submission, http_cache)
+            if updated_dataset is NOT_MODIFIED:
+                continue
             if updated_dataset is not None:
                 # update catalog record
                 updated_dataset.id = dataset.id
@@ -68,9 +83,19 @@ async def do_daily():
                 updated_submission.repository_identifier = submission.repository_identifier
                 updated_submission.repository = submission.repository
                 await updated_submission.replace()
+                # the API reads the submissions of the user again on the next request
+                await User.get_motor_collection().update_many(
+                    {"submissions.$id": submission.id}, {"$inc": {"version": 1}}
+                )
+                # the record is stored, the next refresh can be conditional on the responses it was fetched with
+                await http_cache.save()
             else:
                 # couldn't retrieve matching repository record
-                await db["discovery"].delete_one({"_id": submission.identifier})
+                previous = await db["discovery"].find_one_and_delete(
+                    {"_id": submission.identifier}, projection={"creator_keys": 1}
+                )
+                await increment_version(db, "discovery")
+                await update_creators(db, (previous or {}).get("creator_keys", []), {})
         except Exception as err:
             logger.exception(f"Failed to collect submission {submission.url}\n Error: {str(err)}")
 
@@ -6,8 +6,11 @@ from asyncio import run as aiorun
 from beanie import init_beanie
 from motor.motor_asyncio import AsyncIOMotorClient
 
+from api.cache import increment_version
 from api.config import get_settings
 from api.models.user import Submission
+from api.procedures.creators import create_creators_indexes, creator_entries, update_creators
+from api.procedures.spatial import spatial_coverage_geometry
 
 
 logger = logging.getLogger()
@@ -18,6 +21,7 @@ async def _main():
     settings = get_settings()
     db = AsyncIOMotorClient(settings.db_connection_string)[settings.database_name]
     await init_beanie(database=db, document_models=[Submission])
+    await create_creators_indexes(db)
 
     try:
         while True:
@@ -35,7 +39,11 @@ async def watch_catalog(db: AsyncIOMotorClient):
         async for change in stream:
             if change["operationType"] == "delete":
                 document = change["fullDocumentBeforeChange"]
-                await db["discovery"].delete_one({"_id": document["_id"]})
+                previous = await db["discovery"].find_one_and_delete(
+                    {"_id": document["_id"]}, projection={"creator_keys": 1}
+                )
+                await increment_version(db, "discovery")
+                await update_creators(db, (previous or {}).get("creator_keys", []), {})
             else:
                 document = change["fullDocument"]
                 catalog_entry = await db["catalog"].find_one({"_id": document["_id"]})
@@ -49,9 +57,17 @@ async def watch_catalog(db: AsyncIOMotorClient):
                 catalog_entry["submission_type"] = submission.repository
                 # location of the dataset files e.g. AWS,GCP, Azure, Hydroshare, CUAHSI, etc.
                 catalog_entry["content_location"] = submission.content_location
-                await db["discovery"].find_one_and_replace(
-                        {"_id": document["_id"]}, catalog_entry, upsert=True
+                # GeoJSON of the spatial coverage for geospatial search
+                catalog_entry["spatialGeometry"] = spatial_coverage_geometry(catalog_entry.get("spatialCoverage"))
+                creators = creator_entries(catalog_entry)
+                catalog_entry["creator_keys"] = list(creators)
+                previous = await db["discovery"].find_one_and_replace(
+                        {"_id": document["_id"]}, catalog_entry, upsert=True, projection={"creator_keys": 1}
                     )
+                # invalidate the search results cached by the api
+                await increment_version(db, "discovery")
+                # count the creators credited by the record before and after the change
+                await update_creators(db, (previous or {}).get("creator_keys", []), creators)
 
 
 def main():